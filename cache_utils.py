@@ -0,0 +1,64 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    In-process кеш с временем жизни записей и ограничением размера (LRU).
+
+    get_or_fetch() объединяет одновременные промахи по одному ключу:
+    запрос к БД / HTTP выполняется один раз, остальные ждут его результат.
+    None по умолчанию не кешируется (например, «токена ещё нет»).
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10_000, cache_none: bool = False):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.cache_none = cache_none
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Значение из кеша, иначе результат fetch() (один на все параллельные промахи)."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fill(key, fetch))
+            self._inflight[key] = task
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    async def _fill(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+            if value is not None or self.cache_none:
+                self.set(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
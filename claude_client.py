@@ -1,29 +1,187 @@
-import os, anthropic
+import os, re, time, asyncio, hashlib, anthropic
+from collections import OrderedDict
+from typing import AsyncIterator
 
 ANTHROPIC_KEY = os.getenv("ANTHROPIC_API_KEY")      # читает из .env
-client = anthropic.Anthropic(api_key=ANTHROPIC_KEY)
+# асинхронный клиент: не блокирует event loop на время ответа модели,
+# один на процесс — переиспользует пул соединений httpx
+client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_KEY)
 
 MODEL = "claude-3-haiku-20240307"                   # самая дёшевая модель
 
-async def generate_cover_letter(vacancy: str, resume: str) -> str:
+# Статичная инструкция — общий префикс всех запросов
+INSTRUCTIONS = (
+    "Ты – HR-ассистент. На основе описания вакансии и резюме кандидата "
+    "напиши короткое (до 120 слов) сопроводительное письмо, подчеркивая "
+    "релевантный опыт и мотивированность."
+)
+
+# Кеш готовых писем: одинаковые вакансии (репосты на hh.ru) не гоняем в API
+CACHE_TTL = 24 * 3600                               # сек.
+CACHE_SIZE = 2000
+_letter_cache: "OrderedDict[bytes, tuple[float, str]]" = OrderedDict()
+
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def _normalize(text: str) -> str:
     """
-    vacancy – текст/описание вакансии
-    resume  – твой шаблон резюме (или summary кандидата)
+    Приводит текст к виду для ключа кеша: без тегов, регистра и лишних
+    пробелов. Пунктуацию не трогаем — «C++», «C#» и «.NET» должны давать
+    разные ключи, иначе письмо уйдёт не на ту вакансию.
     """
-    prompt = (
-        "Ты – HR-ассистент. На основе описания вакансии и резюме кандидата "
-        "напиши короткое (до 120 слов) сопроводительное письмо, подчеркивая "
-        "релевантный опыт и мотивированность.\n\n"
-        f"Описание вакансии:\n{vacancy}\n\n"
-        f"Резюме кандидата:\n{resume}"
-    )
+    return " ".join(_TAG_RE.sub(" ", text).casefold().split())
+
+
+def _cache_key(vacancy: str, resume: str) -> bytes:
+    return hashlib.blake2b(
+        f"{_normalize(vacancy)}\0{_normalize(resume)}".encode(), digest_size=16
+    ).digest()
+
 
-    resp = client.messages.create(
+def _cache_get(key: bytes) -> str | None:
+    hit = _letter_cache.get(key)
+    if hit is None:
+        return None
+    created_at, text = hit
+    if time.monotonic() - created_at > CACHE_TTL:
+        del _letter_cache[key]
+        return None
+    _letter_cache.move_to_end(key)
+    return text
+
+
+def _cache_put(key: bytes, text: str) -> None:
+    _letter_cache[key] = (time.monotonic(), text)
+    _letter_cache.move_to_end(key)
+    if len(_letter_cache) > CACHE_SIZE:
+        _letter_cache.popitem(last=False)
+
+
+def _params(resume: str, content: str, max_tokens: int = 300) -> dict:
+    """Параметры запроса к Claude — общие для обычного, потокового и пакетного вызова."""
+    # инструкция + резюме одинаковы для всех вакансий пользователя,
+    # поэтому кладём их в system с cache_control: Anthropic кеширует префикс
+    # на своей стороне (если он длиннее минимального порога — иначе просто
+    # обрабатывает запрос без кеша)
+    return dict(
         model=MODEL,
-        max_tokens=300,
+        max_tokens=max_tokens,
         temperature=0.3,
-        messages=[{"role": "user", "content": prompt}],
+        system=[
+            {"type": "text", "text": INSTRUCTIONS},
+            {
+                "type": "text",
+                "text": f"Резюме кандидата:\n{resume}",
+                "cache_control": {"type": "ephemeral"},
+            },
+        ],
+        messages=[{"role": "user", "content": content}],
+    )
+
+
+def _request(vacancy: str, resume: str) -> dict:
+    return _params(resume, f"Описание вакансии:\n{vacancy}")
+
+
+# ───────── пакетная генерация ─────────
+# Несколько писем одним запросом: общий префикс (инструкция + резюме)
+# оплачивается один раз, а вакансии идут пронумерованным списком.
+BATCH_MAX_TOKENS = 4096                             # предел ответа модели
+_LETTER_SEP_RE = re.compile(r"^[ \t]*###[ \t]*(\d+)[ \t]*$", re.M)
+
+
+def _batch_request(vacancies: list[str], resume: str) -> dict:
+    items = "\n\n".join(
+        f"Вакансия {i}:\n{text}" for i, text in enumerate(vacancies, 1)
     )
+    content = (
+        "Напиши отдельное письмо для каждой вакансии ниже. Перед каждым письмом "
+        "поставь строку «### N», где N — номер вакансии, и не добавляй ничего, "
+        f"кроме писем.\n\n{items}"
+    )
+    return _params(resume, content, min(300 * len(vacancies), BATCH_MAX_TOKENS))
+
+
+def _split_letters(text: str, n: int) -> list[str] | None:
+    """Разбирает ответ «### 1 … ### n» на письма; None, если формат нарушен."""
+    parts = _LETTER_SEP_RE.split(text)
+    # parts = [преамбула, "1", письмо, "2", письмо, ...]
+    letters = {int(num): body.strip() for num, body in zip(parts[1::2], parts[2::2])}
+    if sorted(letters) != list(range(1, n + 1)) or not all(letters.values()):
+        return None
+    return [letters[i] for i in range(1, n + 1)]
+
+
+async def generate_cover_letter(vacancy: str, resume: str) -> str:
+    """
+    vacancy – текст/описание вакансии
+    resume  – твой шаблон резюме (или summary кандидата)
+    """
+    key = _cache_key(vacancy, resume)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    resp = await client.messages.create(**_request(vacancy, resume))
+
+    # resp.content = [TextBlock(type='text', text='...')]
+    if not resp.content:
+        return ""
+    letter = resp.content[0].text.strip()
+    _cache_put(key, letter)
+    return letter
+
+
+async def stream_cover_letter(vacancy: str, resume: str) -> AsyncIterator[str]:
+    """
+    То же, что generate_cover_letter, но отдаёт письмо кусками по мере
+    генерации — чтобы показывать его пользователю, не дожидаясь конца.
+    Письмо из кеша приходит одним куском.
+    """
+    key = _cache_key(vacancy, resume)
+    cached = _cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts: list[str] = []
+    async with client.messages.stream(**_request(vacancy, resume)) as stream:
+        async for text in stream.text_stream:
+            parts.append(text)
+            yield text
+
+    letter = "".join(parts).strip()
+    if letter:
+        _cache_put(key, letter)
+
+
+async def generate_cover_letters(vacancies: list[str], resume: str) -> list[str]:
+    """
+    Письма для нескольких вакансий одного кандидата (порядок сохраняется).
+    Промахи кеша уходят в Claude одним запросом; если модель нарушила
+    формат ответа, недостающие письма генерируются по одному.
+    """
+    keys = [_cache_key(v, resume) for v in vacancies]
+    letters = [_cache_get(k) for k in keys]
+    missing = [i for i, letter in enumerate(letters) if letter is None]
 
-    # resp.content = [{'text': '...', 'type': 'text'}]
-    return resp.content[0]["text"].strip()
+    if len(missing) == 1:
+        i = missing[0]
+        letters[i] = await generate_cover_letter(vacancies[i], resume)
+    elif missing:
+        resp = await client.messages.create(
+            **_batch_request([vacancies[i] for i in missing], resume)
+        )
+        parsed = _split_letters(resp.content[0].text if resp.content else "", len(missing))
+        if parsed is None:
+            parsed = await asyncio.gather(
+                *(generate_cover_letter(vacancies[i], resume) for i in missing)
+            )
+        else:
+            for i, letter in zip(missing, parsed):
+                _cache_put(keys[i], letter)
+        for i, letter in zip(missing, parsed):
+            letters[i] = letter
+    return letters
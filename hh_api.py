@@ -9,8 +9,12 @@ class HHApiClient:
     AUTH_URL = "https://hh.ru/oauth/authorize"  # всегда hh.ru
     TOKEN_URL = "https://hh.ru/oauth/token"
 
-    def __init__(self, token: str | None = None):
-        """Базовая инициализация клиента HH API."""
+    def __init__(self, token: str | None = None, http: httpx.AsyncClient | None = None):
+        """
+        Базовая инициализация клиента HH API.
+        http – общий httpx-клиент приложения: заголовки передаются
+        в каждом запросе, а close() его не закрывает.
+        """
         self._headers = {
             "User-Agent": os.getenv(
                 "HH_USER_AGENT", "HH HunterBot/1.0 (tg:@your_nick)"
@@ -18,7 +22,8 @@ class HHApiClient:
         }
         if token:
             self._headers["Authorization"] = f"Bearer {token}"
-        self._client = httpx.AsyncClient(
+        self._own_client = http is None
+        self._client = http or httpx.AsyncClient(
             base_url="https://api.hh.ru", headers=self._headers, timeout=15
         )
 
@@ -31,7 +36,7 @@ class HHApiClient:
             "code": code,
             "redirect_uri": os.getenv("REDIRECT_URI"),
         }
-        resp = await self._client.post(self.TOKEN_URL, data=data)
+        resp = await self._client.post(self.TOKEN_URL, data=data, headers=self._headers)
         if resp.status_code != 200:
             # Логируем код и тело ответа
             import logging
@@ -44,14 +49,16 @@ class HHApiClient:
         self,
         text: str,
         per_page: int = 20,
+        page: int = 0,
     ) -> List[Dict[str, Any]]:
         """
         Поиск вакансий по тексту.
         """
-        params = {"text": text, "per_page": per_page}
+        params = {"text": text, "per_page": per_page, "page": page}
         resp = await self._client.get(
             f"{self.BASE_URL}/vacancies",
             params=params,
+            headers=self._headers,
         )
         resp.raise_for_status()
         return resp.json().get("items", [])
@@ -60,7 +67,7 @@ class HHApiClient:
         """
         Получение списка резюме пользователя.
         """
-        resp = await self._client.get(f"{self.BASE_URL}/resumes/mine")
+        resp = await self._client.get(f"{self.BASE_URL}/resumes/mine", headers=self._headers)
         resp.raise_for_status()
         return resp.json().get("items", [])
 
@@ -68,7 +75,9 @@ class HHApiClient:
         """
         Получение детальной информации о вакансии по ID.
         """
-        resp = await self._client.get(f"{self.BASE_URL}/vacancies/{vacancy_id}")
+        resp = await self._client.get(
+            f"{self.BASE_URL}/vacancies/{vacancy_id}", headers=self._headers
+        )
         resp.raise_for_status()
         return resp.json()
 
@@ -89,6 +98,7 @@ class HHApiClient:
         resp = await self._client.post(
             f"{self.BASE_URL}/negotiations",
             json=payload,
+            headers=self._headers,
         )
         resp.raise_for_status()
         return resp.json()
@@ -100,7 +110,7 @@ class HHApiClient:
         чтобы скормить его Claude-у для сопроводительного письма.
         """
         url = f"{self.BASE_URL}/resumes/{resume_id}"
-        resp = await self._client.get(url)
+        resp = await self._client.get(url, headers=self._headers)
         resp.raise_for_status()
         data = resp.json()
 
@@ -122,9 +132,10 @@ class HHApiClient:
 
     async def close(self):
         """
-        Закрывает HTTP-сессию.
+        Закрывает HTTP-сессию (общий клиент приложения не трогает).
         """
-        await self._client.aclose()
+        if self._own_client:
+            await self._client.aclose()
 
 
 class AreaSuggestion:
@@ -156,17 +167,27 @@ client = httpx.AsyncClient(
 )
 
 
+# названия областей не меняются — запоминаем навсегда (их всего несколько тысяч)
+_area_names: dict[str, str] = {}
+
+
 async def area_name(area_id: str | int | None) -> str:
     """Возвращает человекочитаемое название области HH."""
     if not area_id:
         return "—"
-    if not str(area_id).isdigit():
-        return str(area_id)
+    area_id = str(area_id)
+    if not area_id.isdigit():
+        return area_id
+    name = _area_names.get(area_id)
+    if name:
+        return name
     try:
-        async with client.get(f"/areas/{area_id}") as resp:
-            if resp.status_code == 200:
-                data = await resp.json()
-                return data.get("name") or str(area_id)
+        resp = await client.get(f"/areas/{area_id}")
+        if resp.status_code == 200:
+            name = resp.json().get("name")
+            if name:
+                _area_names[area_id] = name
+                return name
     except Exception:
         pass
-    return str(area_id)
\ No newline at end of file
+    return area_id
@@ -1,61 +1,112 @@
 import aiosqlite, asyncio
+from settings_utils import DB_PATH, PRAGMAS
+
+# версия последней схемы: её получает новая БД, миграции ниже — старые
+SCHEMA_VERSION = 2
+
+# Вся схема одним скриптом: один проход парсера и один переход
+# в поток aiosqlite вместо отдельного execute на каждую таблицу.
+SCHEMA = """
+    -- --- базовые таблицы ---
+    CREATE TABLE IF NOT EXISTS users (
+        chat_id         INTEGER PRIMARY KEY,
+        settings_msg_id INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS user_tokens (
+        tg_user       INTEGER PRIMARY KEY,
+        access_token  TEXT    NOT NULL,
+        refresh_token TEXT    NOT NULL,
+        expires_at    INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS queues (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        tg_user    INTEGER NOT NULL,
+        vacancy_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_queues_user ON queues (tg_user, created_at);
+    CREATE TABLE IF NOT EXISTS user_settings (
+        tg_user INTEGER,
+        key     TEXT,
+        value   TEXT,
+        PRIMARY KEY (tg_user, key)
+    ) WITHOUT ROWID;
+
+    -- --- новые таблицы ---
+    CREATE TABLE IF NOT EXISTS pending_jobs (
+        tg_user   INTEGER PRIMARY KEY,
+        jobs_json TEXT,
+        cursor    INTEGER DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS user_favorites (
+        tg_user    INTEGER,
+        vacancy_id INTEGER,
+        title      TEXT,
+        url        TEXT,
+        PRIMARY KEY (tg_user, vacancy_id)
+    );
+"""
 
-DB_PATH = "tg_users.db"
 
 async def upgrade(db: aiosqlite.Connection):
-    # --- базовые таблицы ---
-    await db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            chat_id INTEGER PRIMARY KEY
-        );
-    """)
-    await db.execute("""
-        CREATE TABLE IF NOT EXISTS user_tokens (
-            tg_user       INTEGER PRIMARY KEY,
-            access_token  TEXT    NOT NULL,
-            refresh_token TEXT    NOT NULL,
-            expires_at    INTEGER NOT NULL
-        );
-    """)
-    await db.execute("""
-        CREATE TABLE IF NOT EXISTS queues (
-            id         INTEGER PRIMARY KEY AUTOINCREMENT,
-            tg_user    INTEGER NOT NULL,
-            vacancy_id TEXT    NOT NULL,
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
-        );
-    """)
-    await db.execute("""
-        CREATE TABLE IF NOT EXISTS user_settings (
-            tg_user INTEGER,
-            key     TEXT,
-            value   TEXT,
-            PRIMARY KEY (tg_user, key)
-        );
-    """)
-
-    # --- новые таблицы ---
-    await db.execute("""
-        CREATE TABLE IF NOT EXISTS pending_jobs (
-            tg_user   INTEGER PRIMARY KEY,
-            jobs_json TEXT,
-            cursor    INTEGER DEFAULT 0
-        );
-    """)
-    await db.execute("""
-        CREATE TABLE IF NOT EXISTS user_favorites (
-            tg_user    INTEGER,
-            vacancy_id INTEGER,
-            title      TEXT,
-            url        TEXT,
-            PRIMARY KEY (tg_user, vacancy_id)
-        );
-    """)
-
-    await db.commit()
+    async with db.execute("SELECT count(*) FROM sqlite_master") as cur:
+        fresh = (await cur.fetchone())[0] == 0
+    # пустая БД сразу создаётся в последней схеме — ставим ей версию в той же
+    # транзакции, чтобы миграции ниже не пересобирали только что созданное
+    stamp = f"PRAGMA user_version = {SCHEMA_VERSION};" if fresh else ""
+    await db.executescript(f"BEGIN;{SCHEMA}{stamp}COMMIT;")
+
+    # --- миграции данных (номер версии хранится в PRAGMA user_version) ---
+    async with db.execute("PRAGMA user_version") as cur:
+        version = (await cur.fetchone())[0]
+
+    if version < 1:
+        # user_settings → WITHOUT ROWID: поиск по (tg_user, key) идёт
+        # сразу по первичному ключу, без второго прохода по rowid
+        await db.executescript("""
+            BEGIN;
+            CREATE TABLE user_settings_new (
+                tg_user INTEGER,
+                key     TEXT,
+                value   TEXT,
+                PRIMARY KEY (tg_user, key)
+            ) WITHOUT ROWID;
+            INSERT OR REPLACE INTO user_settings_new (tg_user, key, value)
+                SELECT tg_user, key, value FROM user_settings;
+            DROP TABLE user_settings;
+            ALTER TABLE user_settings_new RENAME TO user_settings;
+            PRAGMA user_version = 1;
+            COMMIT;
+        """)
+
+    if version < 2:
+        # queues.vacancy_id TEXT → INTEGER (id вакансий hh.ru числовые):
+        # ключи индекса меньше, сравнение без строк. Колонка с типом TEXT
+        # вернула бы число обратно в строку, поэтому таблицу пересоздаём.
+        await db.executescript("""
+            BEGIN;
+            CREATE TABLE queues_new (
+                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                tg_user    INTEGER NOT NULL,
+                vacancy_id INTEGER NOT NULL,
+                created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+            );
+            INSERT INTO queues_new (id, tg_user, vacancy_id, created_at)
+                SELECT id, tg_user, CAST(vacancy_id AS INTEGER), created_at
+                FROM queues;
+            DROP TABLE queues;
+            ALTER TABLE queues_new RENAME TO queues;
+            CREATE INDEX IF NOT EXISTS idx_queues_user ON queues (tg_user, created_at);
+            PRAGMA user_version = 2;
+            COMMIT;
+        """)
 
 async def main():
     async with aiosqlite.connect(DB_PATH) as db:
+        # page_size действует только для ещё пустой БД, поэтому ставим его
+        # до перехода в WAL и до первого CREATE TABLE
+        await db.execute("PRAGMA page_size = 8192")
+        await db.executescript(PRAGMAS)          # заодно переводит БД в WAL
         await upgrade(db)
 
 asyncio.run(main())
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Any
+
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+
+class DelayQueue(BaseRequestMiddleware):
+    """
+    Ограничитель исходящих запросов к Bot API.
+
+    Telegram допускает ~30 сообщений в секунду на бота и ~1 в секунду
+    в один чат. Каждый запрос с chat_id получает свой «слот» по времени
+    и ждёт его перед отправкой, поэтому запросы уходят в порядке поступления
+    и без 429 Flood control. Подключается один раз:
+    bot.session.middleware(DelayQueue()).
+    """
+
+    def __init__(self, rate: float = 29, per_chat: float = 1, max_chats: int = 10_000):
+        self._interval = 1 / rate
+        self._chat_interval = 1 / per_chat
+        self._max_chats = max_chats
+        self._next_slot = 0.0
+        self._chat_slots: dict[Any, float] = {}
+
+    def _reserve_chat(self, chat_id: Any, now: float) -> float:
+        """Бронирует слот в чате, возвращает задержку до него."""
+        if len(self._chat_slots) > self._max_chats:
+            # выкидываем чаты, слоты которых уже прошли
+            self._chat_slots = {c: t for c, t in self._chat_slots.items() if t > now}
+        slot = max(now, self._chat_slots.get(chat_id, 0.0))
+        self._chat_slots[chat_id] = slot + self._chat_interval
+        return slot - now
+
+    def _reserve_global(self, now: float) -> float:
+        """Бронирует глобальный слот, возвращает задержку до него."""
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self._interval
+        return slot - now
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            loop = asyncio.get_running_loop()
+            # лимит «1 в секунду» касается только новых сообщений в чат
+            if method.__api_method__.startswith("send"):
+                delay = self._reserve_chat(chat_id, loop.time())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            delay = self._reserve_global(loop.time())
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return await make_request(bot, method)
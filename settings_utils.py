@@ -1,10 +1,156 @@
+import asyncio
+import logging
+import sqlite3
 import aiosqlite
 from aiogram import types
 from typing import Optional
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+logger = logging.getLogger(__name__)
+
 # Путь к SQLite базе
 DB_PATH = "tg_users.db"
 
+# WAL + synchronous=NORMAL: fsync только на checkpoint, а не на каждый commit
+PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-65536;
+PRAGMA busy_timeout=3000;
+"""
+
+
+async def connect_db() -> aiosqlite.Connection:
+    """Открывает соединение с БД и применяет PRAGMA-настройки."""
+    db = await aiosqlite.connect(DB_PATH)
+    await db.executescript(PRAGMAS)
+    return db
+
+
+# Одно долгоживущее соединение на процесс: aiosqlite и так выполняет
+# все запросы последовательно в своём потоке, а connect/PRAGMA на каждый
+# вызов стоят дороже самого UPSERT-а.
+_DB: Optional[aiosqlite.Connection] = None
+_DB_LOCK = asyncio.Lock()
+
+
+async def get_db() -> aiosqlite.Connection:
+    """Возвращает общее соединение, открывая его при первом обращении."""
+    global _DB
+    if _DB is None:
+        async with _DB_LOCK:
+            if _DB is None:
+                _DB = await connect_db()
+    return _DB
+
+
+async def close_db() -> None:
+    """
+    Дописывает отложенные настройки и закрывает общее соединение
+    (вызывать при остановке приложения).
+    """
+    global _DB
+    await _stop_writer()
+    if _DB is not None:
+        await _DB.close()
+        _DB = None
+
+
+# ───────── in-memory кеш user_settings ─────────
+# Таблица целиком помещается в память, поэтому чтения обслуживаем из dict,
+# а записи сразу применяем к dict и пачками сбрасываем в SQLite фоновым
+# писателем (write-through с задержкой FLUSH_INTERVAL).
+FLUSH_INTERVAL = 0.05                            # сек.
+
+_SQL_LOAD = "SELECT tg_user, key, value FROM user_settings"
+# UPSERT обновляет строку на месте, а не удаляет и вставляет заново,
+# как INSERT OR REPLACE
+_SQL_SAVE = """
+    INSERT INTO user_settings (tg_user, key, value)
+    VALUES (?, ?, ?)
+    ON CONFLICT (tg_user, key) DO UPDATE SET value = excluded.value
+"""
+
+_settings: Optional[dict[int, dict[str, Optional[str]]]] = None
+_LOAD_LOCK = asyncio.Lock()
+_write_queue: Optional[asyncio.Queue] = None
+_writer_task: Optional[asyncio.Task] = None
+
+
+def _bulk_load() -> dict[int, dict[str, Optional[str]]]:
+    """Читает всю таблицу синхронным sqlite3 (выполняется в отдельном потоке)."""
+    con = sqlite3.connect(DB_PATH)
+    try:
+        loaded: dict[int, dict[str, Optional[str]]] = {}
+        for tg_user, key, value in con.execute(_SQL_LOAD):
+            loaded.setdefault(tg_user, {})[key] = value
+        return loaded
+    finally:
+        con.close()
+
+
+async def load_settings() -> dict[int, dict[str, Optional[str]]]:
+    """Загружает user_settings в память (один раз на процесс)."""
+    global _settings
+    if _settings is None:
+        async with _LOAD_LOCK:
+            if _settings is None:
+                # один переход в поток на всю таблицу вместо передачи
+                # каждой строки через очередь aiosqlite
+                _settings = await asyncio.to_thread(_bulk_load)
+    return _settings
+
+
+async def _flush(batch: list[tuple[int, str, Optional[str]]]) -> None:
+    # для одного (tg_user, key) в пачке оставляем только последнее значение
+    rows = {(u, k): v for u, k, v in batch}
+    db = await get_db()
+    await db.executemany(_SQL_SAVE, [(u, k, v) for (u, k), v in rows.items()])
+    await db.commit()
+
+
+async def _writer() -> None:
+    """Фоновый писатель: копит записи FLUSH_INTERVAL и пишет одной транзакцией."""
+    stop = False
+    while not stop:
+        batch = [await _write_queue.get()]
+        await asyncio.sleep(FLUSH_INTERVAL)
+        while not _write_queue.empty():
+            batch.append(_write_queue.get_nowait())
+        if None in batch:                        # сигнал остановки из close_db
+            stop = True
+            batch = [r for r in batch if r is not None]
+        if batch:
+            try:
+                await _flush(batch)
+            except Exception:
+                logger.exception("Не удалось сохранить %d настроек", len(batch))
+
+
+async def _store(tg_user: int, kv: dict[str, Optional[str]]) -> None:
+    global _write_queue, _writer_task
+    settings = await load_settings()
+    user = settings.setdefault(tg_user, {})
+    if _writer_task is None:
+        _write_queue = asyncio.Queue()
+        _writer_task = asyncio.create_task(_writer())
+    for key, value in kv.items():
+        # в БД колонка TEXT — храним в памяти то же, что вернёт SELECT
+        value = None if value is None else str(value)
+        user[key] = value
+        _write_queue.put_nowait((tg_user, key, value))
+
+
+async def _stop_writer() -> None:
+    """Дописывает очередь в БД и останавливает фонового писателя."""
+    global _writer_task
+    if _writer_task is not None:
+        _write_queue.put_nowait(None)
+        await _writer_task
+        _writer_task = None
+
 
 # ───────── pending ─────────
 async def set_pending(tg_user: int, field: Optional[str]) -> None:
@@ -12,29 +158,12 @@ async def set_pending(tg_user: int, field: Optional[str]) -> None:
     Помечаем, что для пользователя tg_user сейчас ожидается ввод для поля field.
     Для сброса передайте field=None.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            INSERT OR REPLACE INTO user_settings (tg_user, key, value)
-            VALUES (?, 'pending', ?)
-            """,
-            (tg_user, field),
-        )
-        await db.commit()
+    await _store(tg_user, {"pending": field})
 
 
 async def get_pending(tg_user: int) -> Optional[str]:
     """Возвращает текущее pending-поле или None."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            """
-            SELECT value FROM user_settings
-            WHERE tg_user = ? AND key = 'pending'
-            """,
-            (tg_user,),
-        ) as cur:
-            row = await cur.fetchone()
-            return row[0] if row else None
+    return (await load_settings()).get(tg_user, {}).get("pending")
 
 
 # ───────── user settings ─────────
@@ -43,33 +172,34 @@ async def save_user_setting(tg_user: int, key: str, value: str) -> None:
     Сохраняет пользовательское значение (фильтр) по ключу key.
     Пример key: 'region', 'salary', 'work_format', 'employment_type', 'keyword'.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            INSERT OR REPLACE INTO user_settings (tg_user, key, value)
-            VALUES (?, ?, ?)
-            """,
-            (tg_user, key, value),
-        )
-        await db.commit()
+    await _store(tg_user, {key: value})
+
+
+async def save_user_settings(tg_user: int, kv: dict[str, Optional[str]]) -> None:
+    """
+    Сохраняет сразу несколько ключей одной транзакцией (один commit вместо N).
+    Пример: save_user_settings(uid, {"region": "1", "salary": "100000"}).
+    """
+    await _store(tg_user, kv)
 
 
 async def get_user_setting(tg_user: int, key: str) -> Optional[str]:
     """Получает сохранённое значение пользователя по ключу key."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            """
-            SELECT value FROM user_settings
-            WHERE tg_user = ? AND key = ?
-            """,
-            (tg_user, key),
-        ) as cur:
-            row = await cur.fetchone()
-            return row[0] if row else None
+    return (await load_settings()).get(tg_user, {}).get(key)
+
+
+async def get_state(tg_user: int) -> dict[str, str]:
+    """
+    Все сохранённые ключи пользователя разом — для обработчиков,
+    которым нужно несколько настроек сразу.
+    """
+    return dict((await load_settings()).get(tg_user, {}))
 
 
 # ───────── Keyboards ─────────
-def build_main_menu_keyboard() -> types.InlineKeyboardMarkup:
+# Клавиатуры статичны, поэтому собираем их один раз при импорте модуля:
+# вызывающий код берёт константы *_KB, а build_*() оставлены для совместимости.
+def _build_main_menu() -> types.InlineKeyboardMarkup:
     """
     Две «широкие» кнопки-режима по одной в строке,
     ниже – обычное меню 2×2.
@@ -104,7 +234,7 @@ def build_main_menu_keyboard() -> types.InlineKeyboardMarkup:
     return b.as_markup()
 
 
-def build_settings_keyboard(with_back: bool = True) -> types.InlineKeyboardMarkup:
+def _build_settings(with_back: bool) -> types.InlineKeyboardMarkup:
     """Клавиатура управления фильтрами."""
     rows = [
         [
@@ -123,3 +253,19 @@ def build_settings_keyboard(with_back: bool = True) -> types.InlineKeyboardMarku
     if with_back:
         rows.append([types.InlineKeyboardButton(text="⬅️ В меню", callback_data="back_menu")])
     return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+# готовые клавиатуры (общие объекты, не изменять)
+MAIN_MENU_KB = _build_main_menu()
+SETTINGS_KB = _build_settings(with_back=True)
+SETTINGS_KB_NO_BACK = _build_settings(with_back=False)
+
+
+def build_main_menu_keyboard() -> types.InlineKeyboardMarkup:
+    """Главное меню (общий объект, не изменять)."""
+    return MAIN_MENU_KB
+
+
+def build_settings_keyboard(with_back: bool = True) -> types.InlineKeyboardMarkup:
+    """Клавиатура фильтров (общий объект, не изменять)."""
+    return SETTINGS_KB if with_back else SETTINGS_KB_NO_BACK
@@ -6,6 +6,8 @@ import logging
 import aiosqlite
 from aiogram import Bot
 
+from send_queue import DelayQueue
+
 # Загрузка токена бота из переменных окружения
 TOKEN = os.getenv("TG_BOT_TOKEN")
 
@@ -27,6 +29,7 @@ async def send_to_all(text: str):
     Отправляет сообщение text всем chat_id из БД.
     """
     bot = Bot(token=TOKEN)
+    bot.session.middleware(DelayQueue())    # рассылка не быстрее лимитов Telegram
     for chat_id in await _get_all_chats():
         try:
             await bot.send_message(chat_id, text)
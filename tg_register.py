@@ -1,27 +1,39 @@
 import os
-import json, random
+import time
+import asyncio
+import random
 import logging
 from dotenv import load_dotenv
 from urllib.parse import quote_plus
-import aiosqlite
+import httpx
+import orjson
 from fastapi import FastAPI, Request, HTTPException
+from aiosqlitepool import SQLiteConnectionPool
 from aiogram import Bot, types
 from aiogram.exceptions import TelegramBadRequest
 import html
 import re
-import textwrap 
+from collections import OrderedDict, defaultdict
+from functools import lru_cache, partial
 from settings_utils import (
     save_user_setting,
+    save_user_settings,
     get_user_setting,
-    build_settings_keyboard,
-    build_main_menu_keyboard,
+    get_state,
+    MAIN_MENU_KB,
+    SETTINGS_KB,
     set_pending,
     get_pending,
+    load_settings,
+    connect_db,
+    close_db,
 )
-from claude_client import generate_cover_letter
+from claude_client import generate_cover_letters, stream_cover_letter
 from resume_utils import build_resume_keyboard
+from send_queue import DelayQueue
+from cache_utils import TTLCache
 import hh_api
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 
 # ────────── базовая инициализация ──────────
 load_dotenv()
@@ -33,29 +45,72 @@ if not BOT_TOKEN:
     raise RuntimeError("TG_BOT_TOKEN not set")
 
 bot = Bot(token=BOT_TOKEN)
-app = FastAPI()
+bot.session.middleware(DelayQueue())       # не упираемся в лимиты Telegram
+app = FastAPI(default_response_class=ORJSONResponse)
 
-DB_PATH = "tg_users.db"
 if not hasattr(app.state, "cursor"):
     app.state.cursor = {}
 
 # ─── добавь эту строчку ───
 if not hasattr(app.state, "jobs_by_id"):
-    app.state.jobs_by_id = {}          # {uid: {vac_id: vacancy_dict}}
-
-# добавляем ↓
-if not hasattr(app.state, "jobs_cache"):
-    app.state.jobs_cache = {}          # {uid: [vacancy, …]}
+    # {uid: {str(vac_id): vacancy_dict}} — порядок ключей = порядок выдачи
+    app.state.jobs_by_id = {}
+if not hasattr(app.state, "card_locks"):
+    # {uid: asyncio.Lock} — карточки одного пользователя уходят по очереди
+    app.state.card_locks = defaultdict(asyncio.Lock)
+if not hasattr(app.state, "user_locks"):
+    # {uid: asyncio.Lock} — обработчики, меняющие состояние пользователя
+    # (курсор, pending), выполняются по одному, а не гонятся в SQLite
+    app.state.user_locks = defaultdict(asyncio.Lock)
 
 
 # ────────── helpers ──────────
+def db():
+    """
+    Соединение из общего пула (создаётся в _startup):
+    async with db() as conn: …
+    Соединения живут долго, поэтому кеш страниц SQLite остаётся «горячим».
+    """
+    return app.state.db_pool.connection()
+
+
+async def ensure_user(uid: int) -> None:
+    """
+    Заводит строку в users для нового uid. Известные uid (почти все
+    запросы) проверяются по множеству в памяти без записи в БД.
+    """
+    if uid in app.state.known_users:
+        return
+    async with db() as conn:
+        await conn.execute("INSERT OR IGNORE INTO users(chat_id) VALUES (?)", (uid,))
+        await conn.commit()
+    app.state.known_users.add(uid)
+
+
+# access_token по uid (60 с): токен пишет OAuth-callback в другом процессе,
+# поэтому не инвалидируем, а просто ждём TTL; «нет токена» не кешируется
+_token_cache = TTLCache(ttl=60)
+# settings_msg_id по uid: пишем только мы сами, поэтому кеш write-through
+_msg_id_cache = TTLCache(ttl=3600)
+# выдача HH /vacancies по (keyword, page): одинаковые запросы разных
+# пользователей в течение 5 минут не ходят в HH
+_vacancies_cache = TTLCache(ttl=300, maxsize=1000)
+# текст резюме по (uid, resume_id): отклики идут сериями по одному резюме;
+# выбор другого резюме меняет ключ, поэтому инвалидация не нужна
+_resume_cache = TTLCache(ttl=300)
+
+
 async def get_user_token(tg_user: int) -> str | None:
     """
     Читаем access_token из таблицы user_tokens.
     Возвращаем None, если запись не найдена.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
+    return await _token_cache.get_or_fetch(tg_user, lambda: _load_user_token(tg_user))
+
+
+async def _load_user_token(tg_user: int) -> str | None:
+    async with db() as conn:
+        async with conn.execute(
             "SELECT access_token FROM user_tokens WHERE tg_user = ?",
             (tg_user,),
         ) as cur:
@@ -63,10 +118,59 @@ async def get_user_token(tg_user: int) -> str | None:
             return row[0] if row else None
 
 
+async def start_txn(conn, uid: int) -> str | None:
+    """
+    Вся работа /start с БД до отправки сообщения — одна транзакция:
+    строка в users (для нового uid) и свежий access_token.
+    """
+    try:
+        if uid not in app.state.known_users:
+            await conn.execute("INSERT OR IGNORE INTO users(chat_id) VALUES (?)", (uid,))
+        async with conn.execute(
+            "SELECT access_token FROM user_tokens WHERE tg_user = ?",
+            (uid,),
+        ) as cur:
+            row = await cur.fetchone()
+        await conn.commit()
+    except BaseException:
+        await conn.rollback()
+        raise
+    app.state.known_users.add(uid)
+    token = row[0] if row else None
+    # /start часто приходит сразу после OAuth — обновляем кеш токена
+    if token:
+        _token_cache.set(uid, token)
+    return token
+
+
+# ────────── тексты ──────────
+MENU_TEXT = "📌 Главное меню:"
+SETTINGS_TEXT = "Ваши фильтры:"
+OAUTH_BTN_TEXT = "🚀 Начать автоотклики"
+INTRO_HTML = (
+    "<b>👋 Добро пожаловать!</b>\n\n"
+    "Этот бот автоматически откликается на подходящие вакансии hh.ru по вашим фильтрам. "
+    "Настройте регион, зарплату, график и выберите резюме — остальное я сделаю сам."
+)
+INTRO_OAUTH_HTML = (
+    INTRO_HTML
+    + "\n\n<b>Шаг 1.</b> Нажмите кнопку ниже и дайте боту доступ к вашему аккаунту hh.ru."
+)
+INTRO_AUTHORIZED_HTML = f"✅ Вы уже авторизованы.\n\n{INTRO_HTML}"
+
+
 # ────────── подсказки ──────────
-SCHEDULE_SUGGESTIONS = ["полный день", "гибкий график", "сменный график"]
-WORK_FORMAT_SUGGESTIONS = ["дистанционно", "офис", "гибрид"]
-EMPLOYMENT_TYPE_SUGGESTIONS = ["полная", "частичная", "проектная", "стажировка"]
+# кортежи, а не списки: значения входят в ключ lru_cache клавиатур
+SCHEDULE_SUGGESTIONS = ("полный день", "гибкий график", "сменный график")
+WORK_FORMAT_SUGGESTIONS = ("дистанционно", "офис", "гибрид")
+EMPLOYMENT_TYPE_SUGGESTIONS = ("полная", "частичная", "проектная", "стажировка")
+
+# фильтры с текстовым вводом: pending-поле → проверка текста (None — любой)
+PENDING_FIELDS = {
+    "region":  None,
+    "salary":  str.isdigit,
+    "keyword": None,
+}
 
 MULTI_KEYS = {
     "schedule": SCHEDULE_SUGGESTIONS,
@@ -79,7 +183,13 @@ def format_vacancy(v: dict) -> tuple[str, str | None]:
     """
     Возвращает (caption, logo_url).
     caption — HTML-текст, logo_url может быть None.
+    Результат запоминается в самой вакансии: при листании карточка
+    рендерится повторно без regex/wrap.
     """
+    cached = v.get("_cached_caption")
+    if cached:
+        return cached
+
     title   = v["name"]
     company = v.get("employer", {}).get("name", "Без названия")
     logo    = v.get("employer", {}).get("logo_urls", {}).get("240")
@@ -111,15 +221,24 @@ def format_vacancy(v: dict) -> tuple[str, str | None]:
         f"\n{descr}\n"
         f"\n<a href='{v['url']}'>Открыть на hh.ru</a>"
     )
+    v["_cached_caption"] = (caption, logo)
     return caption, logo
 
+def hh_client(token: str | None) -> hh_api.HHApiClient:
+    """Лёгкий HHApiClient поверх общего httpx-клиента (закрывать не нужно)."""
+    return hh_api.HHApiClient(token, http=app.state.http)
+
+
 async def get_resume_summary(uid: int) -> str:
     """Возвращает короткое описание резюме (для сопроводительного)."""
     rid = await get_user_setting(uid, "resume")
     if not rid:
         return ""
-    token = await get_user_token(uid)
-    client = hh_api.HHApiClient(token) if token else hh_api.HHApiClient()
+    return await _resume_cache.get_or_fetch((uid, rid), lambda: _load_resume_summary(uid, rid))
+
+
+async def _load_resume_summary(uid: int, rid: str) -> str:
+    client = hh_client(await get_user_token(uid))
     txt = await client.get_resume_text(rid)          # у тебя уже есть метод
     return txt[:1200]                                # лишнее обрежем
 
@@ -133,53 +252,84 @@ async def send_apply(uid: int, vacancy_id: str, cover_letter: str) -> None:
     if not resume_id:
         raise RuntimeError("Резюме не выбрано")
 
-    client = hh_api.HHApiClient(token) if token else hh_api.HHApiClient()
-    await client.respond_to_vacancy(
+    await hh_client(token).respond_to_vacancy(
         vacancy_id=vacancy_id,
         resume_id=resume_id,
         cover_letter=cover_letter,
     )
 
 
+LETTER_EDIT_INTERVAL = 1.0      # сек. между обновлениями черновика письма
+AUTO_APPLY_CONCURRENCY = 5      # одновременных откликов в режиме автооткликов
+LETTER_BATCH = 5                # писем в одном запросе к Claude
+
+
+async def stream_letter(draft: types.Message, vacancy: str, resume: str) -> str:
+    """
+    Генерирует сопроводительное и показывает черновик в сообщении draft по
+    мере генерации, чтобы пользователь не ждал молча весь ответ модели.
+    """
+    parts: list[str] = []
+    last = time.monotonic()
+    async for chunk in stream_cover_letter(vacancy, resume):
+        parts.append(chunk)
+        if time.monotonic() - last >= LETTER_EDIT_INTERVAL:
+            await safe_edit_text(draft, "✍️ " + "".join(parts), None)
+            last = time.monotonic()
+    return "".join(parts).strip()
+
+
+# статичные ряды карточки вакансии — общие для всех клавиатур
+_JOB_NAV_ROW = [
+    types.InlineKeyboardButton(text="⬅️ Предыдущая", callback_data="job_prev"),
+    types.InlineKeyboardButton(text="➡️ Следующая",  callback_data="job_next"),
+]
+_MENU_ROW = [types.InlineKeyboardButton(text="↩️ Меню", callback_data="back_menu")]
+_BACK_TO_MENU_KB = types.InlineKeyboardMarkup(
+    inline_keyboard=[[types.InlineKeyboardButton(text="⬅️ В меню", callback_data="back_menu")]]
+)
+
+
 def build_job_kb(vac_id: int) -> types.InlineKeyboardMarkup:
     return types.InlineKeyboardMarkup(
         inline_keyboard=[
             [
                 types.InlineKeyboardButton(
-                    text="✅ Откликнуться", callback_data=f"job_apply_{str(vac_id)}"
+                    text="✅ Откликнуться", callback_data=f"job_apply_{vac_id}"
                 ),
                 types.InlineKeyboardButton(
                     text="⭐️ В избранное", callback_data=f"job_fav_{vac_id}"
                 ),
             ],
-            [
-                types.InlineKeyboardButton(text="⬅️ Предыдущая", callback_data="job_prev"),
-                types.InlineKeyboardButton(text="➡️ Следующая",  callback_data="job_next"),
-            ],
-            [types.InlineKeyboardButton(text="↩️ Меню", callback_data="back_menu")],
+            _JOB_NAV_ROW,
+            _MENU_ROW,
         ]
     )
 
 
-async def run_jobs(uid: int) -> None:
+def vacancy_text(v: dict) -> str:
     """
-    Логика команды /jobs вынесена сюда, чтобы можно было
-    запускать её и из текстового сообщения, и из callback-кнопки.
+    Текст вакансии для письма (и ключа кеша писем): название + описание.
+    Без названия все вакансии с «нет описания» получали бы одно письмо.
     """
-    token  = await get_user_token(uid)
-    client = hh_api.HHApiClient(token) if token else hh_api.HHApiClient()
+    snippet = v.get("snippet")
+    return f"{v['name']}\n{snippet}" if snippet else v["name"]
+
 
-    page = await next_jobs_page(uid)            # счётчик 0–19
-    keyword = await get_user_setting(uid, "keyword") or ""
+async def fetch_vacancies(uid: int) -> list[dict]:
+    """
+    Следующая страница вакансий (до 20 шт.) по фильтрам пользователя
+    в компактном виде: id, name, url, salary, employer, snippet.
+    """
+    state = await get_state(uid)                 # все настройки одним запросом
+    page = await next_jobs_page(uid, state)      # счётчик 0–19
+    keyword = state.get("keyword") or ""
 
-    params = {"text": keyword, "per_page": 20, "page": page}
-    resp   = await client._client.get(f"{client.BASE_URL}/vacancies", params=params)
-    resp.raise_for_status()
-    raw_vacs = resp.json().get("items", [])
+    async def fetch() -> list[dict]:
+        client = hh_client(await get_user_token(uid))
+        return await client.search_vacancies(keyword, per_page=20, page=page)
 
-    if not raw_vacs:
-        await bot.send_message(uid, "По вашим фильтрам вакансий не найдено 😕")
-        return
+    raw_vacs = await _vacancies_cache.get_or_fetch((keyword, page), fetch)
 
     vacancies: list[dict] = []
     for v in raw_vacs:
@@ -195,10 +345,109 @@ async def run_jobs(uid: int) -> None:
             "employer": v.get("employer"),
             "snippet":  (full_descr[:1200] + "…") if len(full_descr) > 1200 else full_descr,
         })
+    return vacancies
+
+
+# ────────── фоновая отправка карточек ──────────
+# Фото с hh.ru Telegram скачивает сам, и send_photo может идти секунды.
+# Webhook не ждёт этого: карточки отправляются фоновыми задачами,
+# а per-uid lock сохраняет порядок при быстром листании.
+_background: set[asyncio.Task] = set()
+
+
+def _task_done(task: asyncio.Task) -> None:
+    _background.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Фоновая задача завершилась с ошибкой", exc_info=task.exception())
+
+
+def spawn(coro) -> asyncio.Task:
+    """create_task с сильной ссылкой на задачу и логированием ошибок."""
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_task_done)
+    return task
+
+
+LOCKS_MAX = 10_000
+
+
+def _lock_for(locks: "defaultdict[int, asyncio.Lock]", uid: int) -> asyncio.Lock:
+    """Lock пользователя из реестра; при переполнении выкидывает свободные."""
+    if len(locks) > LOCKS_MAX and uid not in locks:
+        # свободный = не захвачен И без ожидающих: между release() и
+        # пробуждением waiter'а locked() уже False, а выброшенный lock
+        # пустил бы следующего вызывающего параллельно с этим waiter'ом
+        for key in [
+            k for k, lock in locks.items()
+            if not lock.locked() and not lock._waiters
+        ]:
+            del locks[key]
+    return locks[uid]
+
+
+def _card_lock(uid: int) -> asyncio.Lock:
+    return _lock_for(app.state.card_locks, uid)
+
+
+def user_lock(uid: int) -> asyncio.Lock:
+    return _lock_for(app.state.user_locks, uid)
+
+
+async def _post_card(uid: int, caption: str, logo: str | None, kb: types.InlineKeyboardMarkup) -> None:
+    if logo:
+        sent = await bot.send_photo(uid, logo, caption=caption, parse_mode="HTML", reply_markup=kb)
+    else:
+        sent = await bot.send_message(uid, caption, parse_mode="HTML", reply_markup=kb)
+    # запоминаем отрисовку, чтобы «Предыдущая» на первой карточке не ходила в Telegram
+    _remember_render(uid, sent.message_id, _content_hash(caption, logo), _markup_hash(kb))
+
+
+async def _send_card(uid: int, job: dict) -> None:
+    """Отправляет карточку вакансии новым сообщением."""
+    caption, logo = format_vacancy(job)      # текст + картинка (если есть)
+    async with _card_lock(uid):
+        await _post_card(uid, caption, logo, build_job_kb(job["id"]))
+
+
+async def _edit_card(message: types.Message, uid: int, job: dict) -> None:
+    """
+    Перерисовывает карточку вакансии в существующем сообщении — один запрос
+    к Telegram. Удалить и отправить заново приходится, только если меняется
+    тип сообщения (фото ↔ текст): его edit-методы не переключают.
+    """
+    caption, logo = format_vacancy(job)
+    kb = build_job_kb(job["id"])
+    async with _card_lock(uid):
+        if logo and message.photo:
+            await safe_edit_media(message, logo, caption, kb)
+        elif not logo and not message.photo:
+            await safe_edit_text(message, caption, kb, html=True)
+        else:
+            try:
+                await bot.delete_message(uid, message.message_id)
+            except TelegramBadRequest:
+                pass
+            _forget_render(uid, message.message_id)
+            await _post_card(uid, caption, logo, kb)
+
+
+async def run_jobs(uid: int) -> None:
+    """
+    Логика команды /jobs вынесена сюда, чтобы можно было
+    запускать её и из текстового сообщения, и из callback-кнопки.
+    """
+    vacancies = await fetch_vacancies(uid)
 
-    # сохраняем в pending_jobs
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
+    if not vacancies:
+        await bot.send_message(uid, "По вашим фильтрам вакансий не найдено 😕")
+        return
+
+    # в pending_jobs — только id/name/url: этого хватает, чтобы листать
+    # после перезапуска; полные карточки живут в RAM (jobs_by_id)
+    slim = [{"id": v["id"], "name": v["name"], "url": v["url"]} for v in vacancies]
+    async with db() as conn:
+        await conn.execute(
             """
             INSERT INTO pending_jobs(tg_user, jobs_json, cursor)
             VALUES(?, ?, 0)
@@ -206,38 +455,22 @@ async def run_jobs(uid: int) -> None:
             SET jobs_json = excluded.jobs_json,
                 cursor     = 0
             """,
-            (uid, json.dumps(vacancies)),
+            (uid, orjson.dumps(slim)),
         )
-        await db.commit()
+        await conn.commit()
 
-    # держим копию в RAM
-    app.state.jobs_cache = getattr(app.state, "jobs_cache", {})
-    app.state.jobs_cache[uid] = vacancies          # старый список (может пригодиться)
-
-    app.state.jobs_by_id = getattr(app.state, "jobs_by_id", {})
-    app.state.jobs_by_id[uid] = {
-        str(v["id"]): v          # '123456'
-        for v in vacancies
-    } | {
-        int(v["id"]): v          # 123456   (на случай, если id будет int)
-        for v in vacancies
-    }   # ← новый dict
+    # держим копию в RAM; id всегда строкой — callback_data тоже строка
+    app.state.jobs_by_id[uid] = {str(v["id"]): v for v in vacancies}
 
     app.state.cursor.setdefault(uid, {})["jobs"] = 0
 
-    # первая карточка
-    first = vacancies[0]
-    caption, logo = format_vacancy(first)
-    kb_first = build_job_kb(first["id"])
-
-    if logo:
-        await bot.send_photo(uid, logo, caption=caption, parse_mode="HTML", reply_markup=kb_first)
-    else:
-        await bot.send_message(uid, caption, parse_mode="HTML", reply_markup=kb_first)
+    # первая карточка — в фоне, webhook отвечает сразу
+    spawn(_send_card(uid, vacancies[0]))
 
 
+@lru_cache(maxsize=1024)
 def build_fav_kb(fid: int) -> types.InlineKeyboardMarkup:
-    """Клавиатура для карточек в ⭐ Избранное."""
+    """Клавиатура для карточек в ⭐ Избранное (общий объект, не изменять)."""
     return types.InlineKeyboardMarkup(
         inline_keyboard=[
             [
@@ -254,26 +487,54 @@ def build_fav_kb(fid: int) -> types.InlineKeyboardMarkup:
                     callback_data="fav_next",
                 ),
             ],
-            [types.InlineKeyboardButton(text="↩️ Меню", callback_data="back_menu")],
+            _MENU_ROW,
         ]
     )
 
+_TAG_RE = re.compile(r"<[^>]+>")
+_B_RE = re.compile(r"</?b>")                 # жирный заголовок карточки
+
+
 def strip_html(text: str) -> str:
     """Очень грубо убирает теги, чтобы Telegram не порезал сообщение."""
-    return re.sub(r"<[^>]+>", "", text or "")
+    return _TAG_RE.sub("", text or "")
 
 def wrap_long(text: str, width: int = 60) -> str:
-    """Разбивает параграф на короткие строки, чтобы они не растягивались во всю ширину."""
-    return "\n".join(textwrap.wrap(text, width=width))
+    """
+    Разбивает параграф на короткие строки, чтобы они не растягивались во всю ширину.
+    Один проход по строке без токенизации: перенос — по последнему пробелу
+    в пределах width. Слово длиннее width начинается с новой строки и режется
+    кусками по width (textwrap сначала добил бы им текущую строку), так что
+    результат с textwrap.fill совпадает только без таких слов.
+    """
+    text = " ".join(text.split())            # переводы строк и повторы пробелов → один пробел
+    out: list[str] = []
+    i, n = 0, len(text)
+    while i < n:
+        j = i + width
+        if j >= n:
+            out.append(text[i:])
+            break
+        k = text.rfind(" ", i, j + 1)
+        if k > i:
+            out.append(text[i:k])
+            i = k + 1
+        else:
+            out.append(text[i:j])
+            i = j
+    return "\n".join(out)
 
+@lru_cache(maxsize=256)
 def build_inline_suggestions(
-    values: list[str],
+    values: tuple[str, ...],
     prefix: str,
-    selected: set[str] | None = None,
+    selected: frozenset[str] = frozenset(),
     with_back: bool = False,
 ):
-    """Собирает клавиатуру‑однострочник; отмечает выбранные чек‑марк."""
-    selected = selected or set()
+    """
+    Собирает клавиатуру‑однострочник; отмечает выбранные чек‑марк.
+    Аргументы хешируемые: готовая клавиатура кешируется (не изменять).
+    """
     rows = [
         [
             types.InlineKeyboardButton(
@@ -302,60 +563,110 @@ async def toggle_multi_value(user_id: int, key: str, value: str) -> set[str]:
     await save_user_setting(user_id, key, ",".join(items))
     return items
 
-async def next_jobs_page(uid: int) -> int:
+async def next_jobs_page(uid: int, state: dict[str, str] | None = None) -> int:
     """
     Увеличивает счётчик page для /jobs и возвращает новое значение.
     Когда дойдём до 20-й страницы – начинаем сначала.
+    state — уже прочитанные настройки пользователя (см. get_state).
     """
-    curr = int(await get_user_setting(uid, "jobs_page") or 0)
+    if state is None:
+        state = await get_state(uid)
+    curr = int(state.get("jobs_page") or 0)
     new  = curr + 1 if curr < 19 else 0
     await save_user_setting(uid, "jobs_page", str(new))
     return curr
 
-async def build_filters_summary(uid: int) -> str:
-    def esc(v):
-        return html.escape(str(v)) if v else "—"
-
-    region_raw = await get_user_setting(uid, "region")
-    region = esc(await hh_api.area_name(region_raw))
-    salary = esc(await get_user_setting(uid, "salary") or "—")
-    schedule = esc(await get_user_setting(uid, "schedule") or "—")
-    work_fmt = esc(await get_user_setting(uid, "work_format") or "—")
-    employ = esc(await get_user_setting(uid, "employment_type") or "—")
-    keyword = esc(await get_user_setting(uid, "keyword") or "—")
-
-    return (
+_SUMMARY_TMPL = (
     "<b>📋 Ваши действующие фильтры</b>\n"
-    f"• Регион: {region}\n"
-    f"• ЗП ≥ {salary}\n"
-    f"• График: {schedule}\n"
-    f"• Формат работы: {work_fmt}\n"
-    f"• Тип занятости: {employ}\n"
-    f"• Ключевое слово: {keyword}"
+    "• Регион: {region}\n"
+    "• ЗП ≥ {salary}\n"
+    "• График: {schedule}\n"
+    "• Формат работы: {work_format}\n"
+    "• Тип занятости: {employment_type}\n"
+    "• Ключевое слово: {keyword}"
+)
+_SUMMARY_KEYS = ("salary", "schedule", "work_format", "employment_type", "keyword")
+
+
+async def build_filters_summary(uid: int) -> str:
+    d = await get_state(uid)                     # все фильтры разом
+    # текст идёт в Telegram HTML, а не в атрибуты — кавычки не экранируем
+    fields = {k: html.escape(d[k], quote=False) if d.get(k) else "—" for k in _SUMMARY_KEYS}
+    region = await hh_api.area_name(d.get("region"))
+    fields["region"] = html.escape(region, quote=False) if region else "—"
+    return _SUMMARY_TMPL.format_map(fields)
+
+
+# client_id и redirect_uri не меняются после старта — собираем URL один раз,
+# на каждый вызов подставляем только state
+_OAUTH_TMPL = (
+    "https://hh.ru/oauth/authorize?"
+    f"response_type=code&client_id={os.getenv('HH_CLIENT_ID')}"
+    f"&redirect_uri={quote_plus(os.getenv('REDIRECT_URI') or '', safe='')}"
+    "&state={state}"
 )
 
 
 def build_oauth_url(tg_user: int) -> str:
-    rid = os.getenv("REDIRECT_URI")
-    return (
-        "https://hh.ru/oauth/authorize?"
-        f"response_type=code&client_id={os.getenv('HH_CLIENT_ID')}"
-        f"&redirect_uri={quote_plus(rid, safe='')}"
-        f"&state={tg_user}"
+    return _OAUTH_TMPL.format(state=tg_user)
+
+
+@lru_cache(maxsize=1024)
+def build_oauth_kb(tg_user: int) -> types.InlineKeyboardMarkup:
+    """Кнопка авторизации в HH (общий объект, не изменять)."""
+    return types.InlineKeyboardMarkup(
+        inline_keyboard=[[types.InlineKeyboardButton(
+            text=OAUTH_BTN_TEXT, url=build_oauth_url(tg_user)
+        )]]
     )
 
 
+# (chat_id, message_id) -> (hash содержимого, hash клавиатуры) последней
+# отрисовки: повторный edit того же содержимого не отправляем в Telegram.
+# Содержимое None — неизвестно (меняли только клавиатуру).
+_rendered: "OrderedDict[tuple[int, int], tuple[int | None, int]]" = OrderedDict()
+_RENDERED_MAX = 10_000
+
+
+def _markup_hash(markup: types.InlineKeyboardMarkup | None) -> int:
+    return hash(markup.model_dump_json() if markup else None)
+
+
+def _content_hash(text: str, photo_url: str | None = None) -> int:
+    """Хеш содержимого: текст сообщения или (фото, подпись)."""
+    return hash((photo_url, text)) if photo_url else hash(text)
+
+
+def _remember_render(chat_id: int, msg_id: int, content_h: int | None, markup_h: int) -> None:
+    key = (chat_id, msg_id)
+    _rendered[key] = (content_h, markup_h)
+    _rendered.move_to_end(key)
+    if len(_rendered) > _RENDERED_MAX:
+        _rendered.popitem(last=False)
+
+
+def _forget_render(chat_id: int, msg_id: int) -> None:
+    _rendered.pop((chat_id, msg_id), None)
+
+
 async def safe_edit_markup(message: types.Message, markup: types.InlineKeyboardMarkup | None = None):
     """Обновить reply_markup; игнорировать BadRequest, если не изменилось."""
+    chat_id, msg_id = message.chat.id, message.message_id
+    m = _markup_hash(markup)
+    prev = _rendered.get((chat_id, msg_id))
+    if prev and prev[1] == m:
+        return
     try:
         await bot.edit_message_reply_markup(
-            chat_id=message.chat.id,
-            message_id=message.message_id,
+            chat_id=chat_id,
+            message_id=msg_id,
             reply_markup=markup,
         )
     except TelegramBadRequest as e:
         if "message is not modified" not in str(e):
+            _forget_render(chat_id, msg_id)
             raise
+    _remember_render(chat_id, msg_id, prev[0] if prev else None, m)
 
 
 async def safe_edit_text(
@@ -365,6 +676,9 @@ async def safe_edit_text(
     html: bool = False,
 ):
     """Безопасно обновить текст сообщения и клавиатуру."""
+    state = (_content_hash(text), _markup_hash(markup))
+    if _rendered.get((message.chat.id, message.message_id)) == state:
+        return
     try:
         await bot.edit_message_text(
             text=text,
@@ -375,7 +689,9 @@ async def safe_edit_text(
         )
     except TelegramBadRequest as e:
         if "message is not modified" not in str(e):
+            _forget_render(message.chat.id, message.message_id)
             raise
+    _remember_render(message.chat.id, message.message_id, *state)
 
 
 async def safe_edit_media(
@@ -388,6 +704,11 @@ async def safe_edit_media(
     Пытаемся заменить фото и подпись, ловим «message is not modified».
     Если исходное сообщение было без фото – просто удаляем и отправляем заново.
     """
+    state = (_content_hash(caption, photo_url), _markup_hash(markup))
+    if _rendered.get((message.chat.id, message.message_id)) == state:
+        return
+    # забываем заранее: при ошибке или удалении ниже запись уже неверна
+    _forget_render(message.chat.id, message.message_id)
     try:
         media = types.InputMediaPhoto(media=photo_url, caption=caption, parse_mode="HTML")
         await bot.edit_message_media(
@@ -398,62 +719,51 @@ async def safe_edit_media(
         )
     except TelegramBadRequest as e:
         err = str(e)
-        # если сообщение не изменилось или это было text-message, пробуем edit_text
+        # сообщение уже такое, как нужно — просто запоминаем
         if "message is not modified" in err:
-            await safe_edit_text(message, caption, markup, html=True)
+            _remember_render(message.chat.id, message.message_id, *state)
         elif "type of file" in err or "message content is not modified" in err:
             # скорее всего исходное сообщение не фото – удаляем и шлём новое
             await bot.delete_message(message.chat.id, message.message_id)
-            await bot.send_photo(
+            sent = await bot.send_photo(
                 message.chat.id,
                 photo_url,
                 caption=caption,
                 parse_mode="HTML",
                 reply_markup=markup,
             )
+            _remember_render(message.chat.id, sent.message_id, *state)
         else:
             raise
+    else:
+        _remember_render(message.chat.id, message.message_id, *state)
 
 
 
 async def get_settings_msg_id(uid: int) -> int | None:
     """Возвращает сохранённый msg_id сообщения настроек."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            async with db.execute(
-                "SELECT settings_msg_id FROM users WHERE chat_id = ?",
-                (uid,),
-            ) as cur:
-                row = await cur.fetchone()
-                return row[0] if row else None
-        except aiosqlite.OperationalError as e:
-            if "no such column" in str(e).lower():
-                await db.execute(
-                    "ALTER TABLE users ADD COLUMN settings_msg_id INTEGER"
-                )
-                await db.commit()
-                return None
-            raise
+    return await _msg_id_cache.get_or_fetch(uid, lambda: _load_settings_msg_id(uid))
+
+
+async def _load_settings_msg_id(uid: int) -> int | None:
+    async with db() as conn:
+        async with conn.execute(
+            "SELECT settings_msg_id FROM users WHERE chat_id = ?",
+            (uid,),
+        ) as cur:
+            row = await cur.fetchone()
+            return row[0] if row else None
 
 
 async def set_settings_msg_id(uid: int, msg_id: int) -> None:
     """Сохраняет msg_id сообщения настроек."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            await db.execute(
-                "UPDATE users SET settings_msg_id = ? WHERE chat_id = ?",
-                (msg_id, uid),
-            )
-        except aiosqlite.OperationalError as e:
-            if "no such column" in str(e).lower():
-                await db.execute(
-                    "ALTER TABLE users ADD COLUMN settings_msg_id INTEGER"
-                )
-                await db.execute(
-                    "UPDATE users SET settings_msg_id = ? WHERE chat_id = ?",
-                    (msg_id, uid),
-                )
-        await db.commit()
+    async with db() as conn:
+        await conn.execute(
+            "UPDATE users SET settings_msg_id = ? WHERE chat_id = ?",
+            (msg_id, uid),
+        )
+        await conn.commit()
+    _msg_id_cache.set(uid, msg_id)
 
 
 async def safe_edit_text_by_id(
@@ -468,6 +778,10 @@ async def safe_edit_text_by_id(
         new_msg = await bot.send_message(uid, text, reply_markup=markup)
         await set_settings_msg_id(uid, new_msg.message_id)
         return
+    # без пропуска по _rendered: сообщение по сохранённому id могли удалить
+    # (пользователь или другой обработчик) — узнаём это только из ошибки
+    # Telegram и тогда шлём новое
+    state = (_content_hash(text), _markup_hash(markup))
     try:
         await bot.edit_message_text(
             text=text,
@@ -479,13 +793,17 @@ async def safe_edit_text_by_id(
     except TelegramBadRequest as e:
         err = str(e).lower()
         if "message to edit not found" in err:
+            _forget_render(uid, msg_id)
             new_msg = await bot.send_message(uid, text, reply_markup=markup)
             await set_settings_msg_id(uid, new_msg.message_id)
+            return
         elif "message is not modified" not in err:
+            _forget_render(uid, msg_id)
             raise
+    _remember_render(uid, msg_id, *state)
 
 async def show_prev_job(call: types.CallbackQuery, uid: int):
-    jobs   = app.state.jobs_cache.get(uid, [])
+    jobs   = list(app.state.jobs_by_id.get(uid, {}).values())
     cursor = app.state.cursor.get(uid, {}).get("jobs", 0)
 
     if cursor > 0:
@@ -496,15 +814,7 @@ async def show_prev_job(call: types.CallbackQuery, uid: int):
         await bot.answer_callback_query(call.id, "Список пуст")
         return {"ok": True}
 
-    job = jobs[cursor]
-    kb  = build_job_kb(job["id"])          # helper из п. 1-б
-    text, logo = format_vacancy(job)
-
-    if logo:
-        await safe_edit_media(call.message, logo, text, kb)
-    else:
-        await safe_edit_text(call.message, text, kb, html=True)
-
+    spawn(_edit_card(call.message, uid, jobs[cursor]))
     await bot.answer_callback_query(call.id)
     return {"ok": True}
 
@@ -527,42 +837,39 @@ async def show_prev_fav(call: types.CallbackQuery, uid: int):
     await bot.answer_callback_query(call.id)
     return {"ok": True}
 
-async def show_next_fav(call: types.CallbackQuery, uid: int) -> dict:
-    # берём список из кеша и сдвигаем курсор
+async def _show_fav(
+    call: types.CallbackQuery, uid: int, cursor: int, notice: str | None = None
+) -> dict:
+    """Показывает избранное с индексом cursor (список не изменяется)."""
     favs = getattr(app.state, "favs_cache", {}).get(uid, [])
-    if favs:
-        favs.pop(0)                 # убираем показанную карточку
 
     # если больше нечего показывать
-    if not favs:
+    if cursor >= len(favs):
         await safe_edit_text(call.message, "⭐️ Избранное закончилось.", None)
         await bot.answer_callback_query(call.id, "Список пуст ✅")
         app.state.favs_cache.pop(uid, None)
+        app.state.cursor.get(uid, {}).pop("favs", None)
         return {"ok": True}
 
-    # показываем следующую карточку
-    app.state.favs_cache[uid] = favs          # обновили кеш
-    fid, title, url = favs[0]
+    app.state.cursor.setdefault(uid, {})["favs"] = cursor
+    fid, title, url = favs[cursor]
 
     text = (
         f"⭐️ <b>{html.escape(title)}</b>\n"
         f"<a href='{url}'>Открыть на hh.ru</a>"
     )
-    kb = types.InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                types.InlineKeyboardButton(text="🗑 Удалить",     callback_data=f"fav_del_{fid}"),
-                types.InlineKeyboardButton(text="⬅️ Предыдущая", callback_data="fav_prev"),
-                types.InlineKeyboardButton(text="➡️ Следующая", callback_data="fav_next"),  
-            ],
-            [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="back_menu")],
-        ]
-    )
+    kb = build_fav_kb(fid)
     await safe_edit_text(call.message, text, kb, html=True)
-    await bot.answer_callback_query(call.id)
+    await bot.answer_callback_query(call.id, notice)
     return {"ok": True}
 
 
+async def show_next_fav(call: types.CallbackQuery, uid: int) -> dict:
+    # тот же индекс-курсор, что и в show_prev_fav
+    cursor = app.state.cursor.get(uid, {}).get("favs", 0)
+    return await _show_fav(call, uid, cursor + 1)
+
+
 
 async def safe_delete(message: types.Message) -> None:
     "Пытаемся удалить сообщение пользователя, не роняя обработчик."
@@ -575,9 +882,71 @@ async def safe_delete(message: types.Message) -> None:
         pass
 
 
+# ────────── избранное: фоновая запись ──────────
+# job_fav_ кладёт строку в очередь, а один писатель копит строки
+# FAV_FLUSH_INTERVAL и вставляет их одним INSERT … VALUES (…), (…)
+FAV_FLUSH_INTERVAL = 0.05                    # сек.
+FAV_BATCH_MAX = 200                          # 200 × 4 параметра < лимита SQLite в 999
+
+
+async def _flush_favs(rows: list[tuple[int, int, str, str]]) -> None:
+    values = ", ".join(["(?, ?, ?, ?)"] * len(rows))
+    params = [p for row in rows for p in row]
+    async with db() as conn:
+        await conn.execute(
+            "INSERT OR IGNORE INTO user_favorites(tg_user, vacancy_id, title, url) "
+            f"VALUES {values}",
+            params,
+        )
+        await conn.commit()
+
+
+async def _fav_writer() -> None:
+    queue = app.state.fav_queue
+    stop = False
+    while not stop:
+        batch = [await queue.get()]
+        await asyncio.sleep(FAV_FLUSH_INTERVAL)
+        while not queue.empty() and len(batch) < FAV_BATCH_MAX:
+            batch.append(queue.get_nowait())
+        if None in batch:                    # сигнал остановки из _shutdown
+            stop = True
+            batch = [r for r in batch if r is not None]
+            while not queue.empty():         # дописываем всё, что успели положить
+                r = queue.get_nowait()
+                if r is not None:
+                    batch.append(r)
+        for i in range(0, len(batch), FAV_BATCH_MAX):
+            try:
+                await _flush_favs(batch[i:i + FAV_BATCH_MAX])
+            except Exception:
+                logger.exception("Не удалось сохранить %d избранных", len(batch[i:i + FAV_BATCH_MAX]))
+
+
 # ────────── FastAPI lifecycle ──────────
 @app.on_event("startup")
 async def _startup():
+    # пул соединений: connect_db применяет WAL и прочие PRAGMA к каждому
+    app.state.db_pool = SQLiteConnectionPool(connect_db)
+    # один httpx-клиент на процесс: keep-alive и HTTP/2 к api.hh.ru
+    # вместо нового TCP+TLS на каждый HHApiClient
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=15,
+        limits=httpx.Limits(max_keepalive_connections=50),
+    )
+    await load_settings()                   # настройки пользователей — в память
+    app.state.fav_queue = asyncio.Queue()
+    app.state.fav_writer = asyncio.create_task(_fav_writer())
+    async with db() as conn:
+        # колонка появилась позже таблицы — добавляем один раз при старте
+        async with conn.execute("PRAGMA table_info(users)") as cur:
+            cols = {row[1] for row in await cur.fetchall()}
+        if "settings_msg_id" not in cols:
+            await conn.execute("ALTER TABLE users ADD COLUMN settings_msg_id INTEGER")
+            await conn.commit()
+        async with conn.execute("SELECT chat_id FROM users") as cur:
+            app.state.known_users = {row[0] for row in await cur.fetchall()}
     webhook = os.getenv("WEBHOOK_URL")
     if webhook:
         await bot.delete_webhook(drop_pending_updates=True)
@@ -587,415 +956,418 @@ async def _startup():
 
 @app.on_event("shutdown")
 async def _shutdown():
+    app.state.fav_queue.put_nowait(None)
+    await app.state.fav_writer
+    await app.state.db_pool.close()
+    await app.state.http.aclose()
+    await close_db()
     await bot.session.close()
 
 
-# ────────── main webhook ──────────
-@app.post("/bot{token:path}")
-async def telegram_webhook(request: Request, token: str):
-    if token != BOT_TOKEN:
-        raise HTTPException(status_code=403, detail="Invalid token")
+# ────────── callback handlers ──────────
+# Обработчики кнопок: точные callback_data → handler(call, uid),
+# префиксы (fav_del_<id>, filter_<key>, …) → handler(call, uid, arg).
+async def on_back_menu(call: types.CallbackQuery, uid: int) -> dict:
+    # убираем открытую карточку (если ещё не удалили)
+    try:
+        await bot.delete_message(uid, call.message.message_id)
+    except TelegramBadRequest:
+        pass
+    _forget_render(uid, call.message.message_id)
 
-    update = types.Update(**await request.json())
+    smsg = await get_settings_msg_id(uid)
+    await safe_edit_text_by_id(
+        uid, smsg, MENU_TEXT, MAIN_MENU_KB
+    )
+    await bot.answer_callback_query(call.id)
+    return {"ok": True}
 
-    # ===== CALLBACKS =====
-    if update.callback_query:
-        call = update.callback_query
-        uid = call.from_user.id
-        data = call.data
 
-        # ensure user row exists
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("INSERT OR IGNORE INTO users(chat_id) VALUES (?)", (uid,))
-            await db.commit()
+async def on_start_auto(call: types.CallbackQuery, uid: int) -> dict:
+    """Запуск автооткликов (20 штук)."""
+    await bot.answer_callback_query(call.id)
+
+    resume_id = await get_user_setting(uid, "resume")
+    if not resume_id:
+        await bot.send_message(uid, "Сначала выберите резюме в меню «📄 Резюме».")
+        return {"ok": True}
+
+    # берём свежие 20 вакансий тем же fetch, что и /jobs
+    vacancies = (await fetch_vacancies(uid))[:20]
+    resume = await get_resume_summary(uid)
+    client = hh_client(await get_user_token(uid))
+
+    # письма генерируем пачками по LETTER_BATCH одним запросом к Claude,
+    # отклики в HH — параллельно, но не больше N одновременно
+    sem = asyncio.Semaphore(AUTO_APPLY_CONCURRENCY)
 
-        # === возврат в главное меню ===
-        if data == "back_menu":
-            # убираем открытую карточку (если ещё не удалили)
+    async def apply_one(v: dict, cover: str) -> bool:
+        async with sem:
             try:
-                await bot.delete_message(uid, call.message.message_id)
-            except TelegramBadRequest:
-                pass
+                await client.respond_to_vacancy(
+                    vacancy_id=v["id"],
+                    resume_id=resume_id,
+                    cover_letter=cover,
+                )
+                return True
+            except Exception as e:
+                logger.warning("fail apply %s: %s", v["id"], e)
+                return False
 
-            smsg = await get_settings_msg_id(uid)
-            await safe_edit_text_by_id(
-                uid, smsg, "📌 Главное меню:", build_main_menu_keyboard()
-            )
-            await bot.answer_callback_query(call.id)
-            return {"ok": True}
-
-
-         # ─── запуск авто-откликов (20 штук) ───
-        if data == "start_auto":
-            await bot.answer_callback_query(call.id)
-
-            # берём свежие 20 вакансий через уже готовый fetch в run_jobs
-            vacancies = await fetch_vacancies(uid)      # функция есть в run_jobs
-            resume = await get_resume_summary(uid)
-
-            sent = 0
-            for v in vacancies[:20]:
-                cover = await generate_cover_letter(v["snippet"] or v["name"], resume)
-                try:
-                    await send_apply(uid, v["id"], cover)
-                    sent += 1
-                except Exception as e:
-                    logger.warning("fail apply %s: %s", v["id"], e)
-
-            await bot.send_message(uid, f"🚀 Автоотклики отправлены: {sent}/20")
-            return {"ok": True}
-
-        # ─── ручной режим: просто открываем /jobs на первую страницу ───
-        if data == "start_manual":
-            await bot.answer_callback_query(call.id)
-            await run_jobs(uid)          # функция уже есть
-            return {"ok": True}
-            
-        # === открыть настройку фильтров ===
-        if data == "open_settings":
-            smsg = await get_settings_msg_id(uid)
-            await safe_edit_text_by_id(uid, smsg, "Ваши фильтры:", build_settings_keyboard())
-            await bot.answer_callback_query(call.id)
-            return {"ok": True}
-
-        # === открыть резюме ===
-        if data == "open_resumes":
-            kb = await build_resume_keyboard(uid)
-            await safe_edit_text(
-                call.message,
-                "📄 Ваши резюме:",
-                kb,
-            )
-            return {"ok": True}
-
-        # === открыть избранные вакансии ===
-        if data == "open_favorites":
-            async with aiosqlite.connect(DB_PATH) as db:
-                async with db.execute(
-                    "SELECT vacancy_id, title, url FROM user_favorites "
-                    "WHERE tg_user = ? ORDER BY rowid DESC",
-                    (uid,),
-                ) as cur:
-                    favs = await cur.fetchall()
-
-            if not favs:
-                await bot.answer_callback_query(call.id, "Список пуст 🙂", show_alert=True)
-                return {"ok": True}
-
-            # показываем по одной как в /jobs
-            fid, title, url = favs[0]
-            text = f"⭐️ <b>{html.escape(title)}</b>\n<a href='{url}'>Открыть на hh.ru</a>"
-
-            kb_fav = types.InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        types.InlineKeyboardButton(text="🗑 Удалить",   callback_data=f"fav_del_{fid}"),
-                        types.InlineKeyboardButton(text="⬅️ Предыдущая", callback_data="fav_prev"),
-                        types.InlineKeyboardButton(text="➡️ Следующая", callback_data="fav_next"),     
-                    ],
-                    [
-                        types.InlineKeyboardButton(text="⬅️ Назад",     callback_data="back_menu"),
-                    ],
-                ]
+    async def apply_batch(batch: list[dict]) -> int:
+        try:
+            covers = await generate_cover_letters(
+                [vacancy_text(v) for v in batch], resume
             )
+        except Exception as e:
+            logger.warning("fail letters for %d vacancies: %s", len(batch), e)
+            return 0
+        results = await asyncio.gather(
+            *(apply_one(v, c) for v, c in zip(batch, covers))
+        )
+        return sum(results)
 
-            # сохраняем список в память пользователя
-            await bot.delete_message(uid, call.message.message_id)
-            await bot.send_message(uid, text, reply_markup=kb_fav, parse_mode="HTML")
-            await bot.answer_callback_query(call.id)
-            # временно кладём favs в RAM-словарь (ключ = uid)
-            app.state.favs_cache = getattr(app.state, "favs_cache", {})
-            app.state.favs_cache[uid] = favs
-            return {"ok": True}
-
-            
-        # ---------- листаем избранное ----------  <-- новый комментарий
-        elif data == "fav_prev":
-            return await show_prev_fav(call, uid)
-
-        elif data == "fav_next":
-            return await show_next_fav(call, uid)
-
-        elif data.startswith("fav_del_"):
-            fid = int(data.split("_")[-1])
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute(
-                    "DELETE FROM user_favorites WHERE tg_user = ? AND vacancy_id = ?",
-                    (uid, fid),
-                )
-                await db.commit()
-
-            # обновляем кеш и сразу показываем следующую
-            favs = getattr(app.state, "favs_cache", {}).get(uid, [])
-            favs = [f for f in favs if f[0] != fid]
-            app.state.favs_cache[uid] = favs
-            await bot.answer_callback_query(call.id, "Удалено")
-            return await show_next_fav(call, uid)
-        
-        # ---------- fav_del_<id> ----------
-        if data.startswith("fav_del_"):
-            fid = int(data.split("_")[-1])
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute(
-                    "DELETE FROM user_favorites WHERE tg_user = ? AND vacancy_id = ?",
-                    (uid, fid),
-                )
-                await db.commit()
+    batches = [
+        vacancies[i:i + LETTER_BATCH]
+        for i in range(0, len(vacancies), LETTER_BATCH)
+    ]
+    results = await asyncio.gather(*(apply_batch(b) for b in batches))
 
-            # убираем из кеша и жмём fav_next, чтобы показать следующее
-            favs = getattr(app.state, "favs_cache", {}).get(uid, [])
-            favs = [f for f in favs if f[0] != fid]
-            app.state.favs_cache[uid] = favs
-            await bot.answer_callback_query(call.id, "Удалено")
-            return await show_next_fav(call, uid)
+    sent = sum(results)
+    await bot.send_message(uid, f"🚀 Автоотклики отправлены: {sent}/{len(vacancies)}")
+    return {"ok": True}
 
-        if data == "show_filters":
-            summary = await build_filters_summary(uid)
-            await safe_edit_text(
-                call.message,
-                summary,
-                types.InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [
-                            types.InlineKeyboardButton(
-                                text="⬅️ В меню", callback_data="back_menu"
-                            )
-                        ]
-                    ]
-                ),
-                html=True,
-            )
-            await bot.answer_callback_query(call.id)
-            return {"ok": True}
-
-        if data == "back_settings":
-            smsg = await get_settings_msg_id(uid)
-            await safe_edit_text_by_id(
-                uid,
-                smsg,
-                "Ваши фильтры:",
-                build_settings_keyboard(),
-            )
-            await bot.answer_callback_query(call.id)
-            return {"ok": True}
-
-
-        # ---------- запуск фильтров ----------
-        if data.startswith("filter_"):
-            fkey = data.split("_", 1)[1]
-
-            if fkey == "region":
-                await set_pending(uid, "region")
-                await safe_edit_text(call.message, "Введите название региона:", None)
-                return {"ok": True}
-
-            if fkey == "salary":
-                await set_pending(uid, "salary")
-                await safe_edit_text(call.message, "Введите минимальную зарплату (число):", None)
-                return {"ok": True}
-
-            if fkey == "keyword":
-                await set_pending(uid, "keyword")
-                await safe_edit_text(call.message, "Введите ключевое слово:", None)
-                return {"ok": True}
-
-            if fkey in MULTI_KEYS:
-                selection = await get_user_setting(uid, fkey) or ""
-                sel_set = {i.strip() for i in selection.split(",") if i.strip()}
-                await safe_edit_text(
-                    call.message,
-                    f"Выберите {fkey.replace('_', ' ')} (можно несколько):",
-                    build_inline_suggestions(
-                        MULTI_KEYS[fkey], f"{fkey}_suggest", sel_set, with_back=True
-                    ),
-                )
-                return {"ok": True}
 
-        # ---------- мультивыбор ----------
-        for m in MULTI_KEYS:
-            prefix = f"{m}_suggest_"
-            if data.startswith(prefix):
-                val = data[len(prefix):]
-                sel_set = await toggle_multi_value(uid, m, val)
-                await safe_edit_markup(
-                    call.message,
-                    build_inline_suggestions(
-                        MULTI_KEYS[m], f"{m}_suggest", sel_set, with_back=True
-                    ),
-                )
-                await bot(call.answer("✓"))
-                return {"ok": True}
-
-
-        # ---------- region из suggestions ----------
-        if data.startswith("region_suggest_"):
-            area_id = int(data.split("_")[-1])
-            await save_user_setting(uid, "region", area_id)
-            await safe_edit_markup(call.message, None)
-            await bot(call.answer("Сохранено"))
-            return {"ok": True}
-
-        # ---------- выбор резюме ----------
-        if data.startswith("select_resume_"):
-            rid = data.split("_")[-1]
-            await save_user_setting(uid, "resume", rid)
-            await bot(call.answer("Резюме сохранено"))
-            return {"ok": True}
-        
-        if data == "find_jobs":
-            await bot.answer_callback_query(call.id)
-            await bot.send_message(uid,
-                "Окей! Нажмите /jobs, чтобы получить список вакансий по вашим фильтрам.")
-            return {"ok": True}
-
-                # ─────────── кнопки поиска вакансий ───────────
-                # ─────────── кнопки поиска вакансий ───────────
-
-        if data == "job_prev":
-            return await show_prev_job(call, uid)
-
-        if data == "job_next":
-            async with aiosqlite.connect(DB_PATH) as db:
-                async with db.execute(
-                    "SELECT jobs_json, cursor FROM pending_jobs WHERE tg_user = ?",
-                    (uid,),
-                ) as cur:
-                    row = await cur.fetchone()
+async def on_start_manual(call: types.CallbackQuery, uid: int) -> dict:
+    """Ручной режим: просто открываем /jobs на первую страницу."""
+    await bot.answer_callback_query(call.id)
+    await run_jobs(uid)
+    return {"ok": True}
 
-                if not row:
-                    await bot.answer_callback_query(call.id, "Список пуст.")
-                    return {"ok": True}
 
-                jobs, cursor = json.loads(row[0]), row[1] + 1
-                app.state.cursor.setdefault(uid, {})["jobs"] = cursor
+async def on_open_settings(call: types.CallbackQuery, uid: int) -> dict:
+    smsg = await get_settings_msg_id(uid)
+    await safe_edit_text_by_id(uid, smsg, SETTINGS_TEXT, SETTINGS_KB)
+    await bot.answer_callback_query(call.id)
+    return {"ok": True}
 
-                # ----- если дошли до конца списка -----
-                if cursor >= len(jobs):
-                    await bot.answer_callback_query(call.id, "Вакансии закончились ✅")
-                    await safe_edit_markup(call.message, None)
-                    await db.execute(
-                        "DELETE FROM pending_jobs WHERE tg_user = ?",
-                        (uid,),
-                    )
-                    await db.commit()
-                    return {"ok": True}
 
-                # сохраняем новый cursor
-                await db.execute(
-                    "UPDATE pending_jobs SET cursor = ? WHERE tg_user = ?",
-                    (cursor, uid),
+async def on_open_resumes(call: types.CallbackQuery, uid: int) -> dict:
+    kb = await build_resume_keyboard(uid)
+    await safe_edit_text(call.message, "📄 Ваши резюме:", kb)
+    return {"ok": True}
+
+
+async def on_open_favorites(call: types.CallbackQuery, uid: int) -> dict:
+    async with db() as conn:
+        async with conn.execute(
+            "SELECT vacancy_id, title, url FROM user_favorites "
+            "WHERE tg_user = ? ORDER BY rowid DESC",
+            (uid,),
+        ) as cur:
+            favs = await cur.fetchall()
+
+    if not favs:
+        await bot.answer_callback_query(call.id, "Список пуст 🙂", show_alert=True)
+        return {"ok": True}
+
+    # показываем по одной как в /jobs
+    fid, title, url = favs[0]
+    text = f"⭐️ <b>{html.escape(title)}</b>\n<a href='{url}'>Открыть на hh.ru</a>"
+
+    await bot.delete_message(uid, call.message.message_id)
+    _forget_render(uid, call.message.message_id)
+    await bot.send_message(uid, text, reply_markup=build_fav_kb(fid), parse_mode="HTML")
+    await bot.answer_callback_query(call.id)
+    # временно кладём favs в RAM-словарь (ключ = uid)
+    app.state.favs_cache = getattr(app.state, "favs_cache", {})
+    app.state.favs_cache[uid] = favs
+    app.state.cursor.setdefault(uid, {})["favs"] = 0
+    return {"ok": True}
+
+
+async def on_fav_del(call: types.CallbackQuery, uid: int, arg: str) -> dict:
+    fid = int(arg)
+    async with db() as conn:
+        await conn.execute(
+            "DELETE FROM user_favorites WHERE tg_user = ? AND vacancy_id = ?",
+            (uid, fid),
+        )
+        await conn.commit()
+
+    # обновляем кеш: на место удалённой встаёт следующая — показываем её
+    favs = getattr(app.state, "favs_cache", {}).get(uid, [])
+    favs = [f for f in favs if f[0] != fid]
+    app.state.favs_cache[uid] = favs
+    cursor = app.state.cursor.get(uid, {}).get("favs", 0)
+    return await _show_fav(call, uid, cursor, "Удалено")
+
+
+async def on_show_filters(call: types.CallbackQuery, uid: int) -> dict:
+    summary = await build_filters_summary(uid)
+    await safe_edit_text(call.message, summary, _BACK_TO_MENU_KB, html=True)
+    await bot.answer_callback_query(call.id)
+    return {"ok": True}
+
+
+async def on_back_settings(call: types.CallbackQuery, uid: int) -> dict:
+    smsg = await get_settings_msg_id(uid)
+    await safe_edit_text_by_id(
+        uid,
+        smsg,
+        SETTINGS_TEXT,
+        SETTINGS_KB,
+    )
+    await bot.answer_callback_query(call.id)
+    return {"ok": True}
+
+
+async def on_find_jobs(call: types.CallbackQuery, uid: int) -> dict:
+    await bot.answer_callback_query(call.id)
+    await bot.send_message(uid,
+        "Окей! Нажмите /jobs, чтобы получить список вакансий по вашим фильтрам.")
+    return {"ok": True}
+
+
+async def on_filter(call: types.CallbackQuery, uid: int, fkey: str) -> dict:
+    """Запуск фильтра: текстовый ввод или мультивыбор из подсказок."""
+    if fkey == "region":
+        await set_pending(uid, "region")
+        await safe_edit_text(call.message, "Введите название региона:", None)
+        return {"ok": True}
+
+    if fkey == "salary":
+        await set_pending(uid, "salary")
+        await safe_edit_text(call.message, "Введите минимальную зарплату (число):", None)
+        return {"ok": True}
+
+    if fkey == "keyword":
+        await set_pending(uid, "keyword")
+        await safe_edit_text(call.message, "Введите ключевое слово:", None)
+        return {"ok": True}
+
+    if fkey in MULTI_KEYS:
+        selection = await get_user_setting(uid, fkey) or ""
+        sel_set = {i.strip() for i in selection.split(",") if i.strip()}
+        await safe_edit_text(
+            call.message,
+            f"Выберите {fkey.replace('_', ' ')} (можно несколько):",
+            build_inline_suggestions(
+                MULTI_KEYS[fkey], f"{fkey}_suggest", frozenset(sel_set), with_back=True
+            ),
+        )
+    return {"ok": True}
+
+
+async def on_multi_suggest(key: str, call: types.CallbackQuery, uid: int, val: str) -> dict:
+    """Переключает значение мультивыбора key (schedule, work_format, …)."""
+    sel_set = await toggle_multi_value(uid, key, val)
+    await safe_edit_markup(
+        call.message,
+        build_inline_suggestions(
+            MULTI_KEYS[key], f"{key}_suggest", frozenset(sel_set), with_back=True
+        ),
+    )
+    await bot(call.answer("✓"))
+    return {"ok": True}
+
+
+async def on_region_suggest(call: types.CallbackQuery, uid: int, arg: str) -> dict:
+    await save_user_setting(uid, "region", int(arg))
+    await safe_edit_markup(call.message, None)
+    await bot(call.answer("Сохранено"))
+    return {"ok": True}
+
+
+async def on_select_resume(call: types.CallbackQuery, uid: int, rid: str) -> dict:
+    await save_user_setting(uid, "resume", rid)
+    await bot(call.answer("Резюме сохранено"))
+    return {"ok": True}
+
+
+# ─────────── кнопки поиска вакансий ───────────
+async def on_job_next(call: types.CallbackQuery, uid: int) -> dict:
+    # двойной тап «Следующая» сдвигает курсор по очереди, а не параллельно
+    async with user_lock(uid):
+        return await _job_next(call, uid)
+
+
+async def _job_next(call: types.CallbackQuery, uid: int) -> dict:
+    # список и курсор — в RAM (jobs_by_id / cursor); в БД пишем лишь новый
+    # cursor. jobs_json читаем только после перезапуска, когда в памяти
+    # пусто, — сдвиг и чтение тогда делает один UPDATE … RETURNING
+    jobs = list(app.state.jobs_by_id.get(uid, {}).values())
+    cursor = app.state.cursor.get(uid, {}).get("jobs", 0) + 1
+    async with db() as conn:
+        try:
+            if not jobs:
+                async with conn.execute(
+                    "UPDATE pending_jobs SET cursor = cursor + 1 WHERE tg_user = ? "
+                    "RETURNING cursor, jobs_json",
+                    (uid,),
+                ) as cur:
+                    row = await cur.fetchone()
+                if row:
+                    cursor, jobs = row[0], orjson.loads(row[1])
+                    # возвращаем список в RAM: следующие тапы и job_apply_
+                    # снова ищут вакансию по id за O(1)
+                    app.state.jobs_by_id[uid] = {str(j["id"]): j for j in jobs}
+                    if cursor >= len(jobs):
+                        # строка удалена — курсор держим в RAM на последней
+                        # карточке, иначе следующий тап начнёт список заново
+                        app.state.cursor.setdefault(uid, {})["jobs"] = len(jobs) - 1
+                        await conn.execute(
+                            "DELETE FROM pending_jobs WHERE tg_user = ?", (uid,)
+                        )
+            elif cursor >= len(jobs):
+                await conn.execute(
+                    "DELETE FROM pending_jobs WHERE tg_user = ?", (uid,)
                 )
-                await db.commit()
-
-            # пропускаем пустые элементы
-            while cursor < len(jobs) and not isinstance(jobs[cursor], dict):
-                cursor += 1
-
-            # дошли до конца — выходим
-            if cursor >= len(jobs):
-                await bot.answer_callback_query(call.id, "Вакансии закончились ✅")
-                await safe_edit_markup(call.message, None)
-                async with aiosqlite.connect(DB_PATH) as db:
-                    await db.execute("DELETE FROM pending_jobs WHERE tg_user = ?", (uid,))
-                    await db.commit()
-                return {"ok": True}
-
-            # сохраняем скорректированный cursor
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute(
+            else:
+                await conn.execute(
                     "UPDATE pending_jobs SET cursor = ? WHERE tg_user = ?",
                     (cursor, uid),
                 )
-                await db.commit()
-            app.state.cursor.setdefault(uid, {})["jobs"] = cursor
-
-            job = jobs[cursor]                       # гарантированно dict
-            caption, logo = format_vacancy(job)      # текст + картинка (если есть)
-
-            kb_next = build_job_kb(job["id"])
-
-            # убираем старое сообщение и отправляем новое
-            await bot.delete_message(uid, call.message.message_id)
-            if logo:
-                await bot.send_photo(
-                    uid,
-                    logo,
-                    caption=caption,
-                    parse_mode="HTML",
-                    reply_markup=kb_next,
-                )
-            else:
-                await bot.send_message(
-                    uid,
-                    caption,
-                    parse_mode="HTML",
-                    reply_markup=kb_next,
-                )
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+
+    if not jobs:
+        await bot.answer_callback_query(call.id, "Список пуст.")
+        return {"ok": True}
+
+    # ----- если дошли до конца списка -----
+    if cursor >= len(jobs):
+        await bot.answer_callback_query(call.id, "Вакансии закончились ✅")
+        await safe_edit_markup(call.message, None)
+        return {"ok": True}
+
+    app.state.cursor.setdefault(uid, {})["jobs"] = cursor
+    job = jobs[cursor]
 
-            await bot.answer_callback_query(call.id)
-            return {"ok": True}
+    # редактируем текущую карточку (в фоне)
+    spawn(_edit_card(call.message, uid, job))
+    await bot.answer_callback_query(call.id)
+    return {"ok": True}
 
 
+async def on_job_apply(call: types.CallbackQuery, uid: int, vac_id: str) -> dict:
+    # берём текст текущей вакансии из jobs_by_id
+    job = app.state.jobs_by_id.get(uid, {}).get(vac_id)
 
-        if data.startswith("job_apply_"):
-            vac_id = data.split("_")[-1]
+    if not job:                                   # не нашли
+        await bot.answer_callback_query(call.id, "⛔️ Вакансия не найдена")
+        return {"ok": True}
 
-            # берём текст текущей вакансии из jobs_cache
-            store = getattr(app.state, "jobs_by_id", {}).get(uid, {})
-            job = store.get(vac_id)
+    # письмо генерируется секунды — отвечаем на нажатие сразу,
+    # а отклик отправляем фоновой задачей
+    await bot.answer_callback_query(call.id, "⏳ Готовлю отклик…")
+    spawn(_apply_job(uid, vac_id, job))
+    return {"ok": True}
 
-            # запасной обход списка, если вдруг словарь пустой
-            if not job:
-                for j in getattr(app.state, "jobs_cache", {}).get(uid, []):
-                    if str(j["id"]) == vac_id:
-                        job = j
-                        break
 
-            if not job:                                   # всё равно не нашли
-                await bot.answer_callback_query(call.id, "⛔️ Вакансия не найдена")
-                return {"ok": True}
+async def _apply_job(uid: int, vac_id: str, job: dict) -> None:
+    """Письмо (с живым черновиком в чате) + отклик в HH."""
+    # нажатие уже подтверждено «Готовлю отклик…» — любая ошибка ниже должна
+    # дойти до пользователя, а не остаться только в логе spawn
+    draft: types.Message | None = None
+    cover = ""
+    try:
+        resume_text = await get_resume_summary(uid)
+        draft = await bot.send_message(uid, "✍️ Пишу сопроводительное письмо…")
+        cover = await stream_letter(draft, vacancy_text(job), resume_text)
+        if not cover:
+            await safe_edit_text(
+                draft, "⛔️ Не удалось составить письмо — отклик не отправлен.", None
+            )
+            return
+        await send_apply(uid, vac_id, cover)
+    except Exception:
+        fail = "⛔️ Не удалось отправить отклик."
+        if cover:
+            fail += f"\n\n{cover}"
+        if draft is None:
+            await bot.send_message(uid, fail)
+        else:
+            await safe_edit_text(draft, fail, None)
+        raise
+    await safe_edit_text(draft, f"✅ Отклик отправлен.\n\n{cover}", None)
 
-            vacancy_text = job["snippet"] or job["name"]
 
-            resume_text = await get_resume_summary(uid)
-            cover = await generate_cover_letter(vacancy_text, resume_text)
+async def on_job_fav(call: types.CallbackQuery, uid: int, arg: str) -> dict:
+    vac_id = int(arg)
 
-            await send_apply(uid, vac_id, cover)
-            await bot.answer_callback_query(call.id, "🔔 Отклик + письмо отправлены!")
-            return {"ok": True}
+    # --- универсально берём HTML-текст карточки (text или caption)
+    content_html = (
+        getattr(call.message, "html_text", None)
+        or getattr(call.message, "caption_html", None)
+        or call.message.text
+        or call.message.caption
+        or ""
+    )
+    title = _B_RE.sub("", content_html.partition("\n")[0])
 
+    # ссылки могут быть в entities ИЛИ caption_entities
+    entities = call.message.entities or call.message.caption_entities or []
+    url_ent  = next((e for e in entities if e.type == "text_link"), None)
 
-        if data.startswith("job_fav_"):
-            vac_id = int(data.split("_")[-1])
+    # запись в БД — фоновым писателем, ответ на нажатие не ждёт commit
+    app.state.fav_queue.put_nowait((uid, vac_id, title, url_ent.url if url_ent else ""))
+    await bot.answer_callback_query(call.id, "⭐️ Добавлено в избранное")
+    return {"ok": True}
 
-            # --- универсально берём HTML-текст карточки (text или caption)
-            content_html = (
-                getattr(call.message, "html_text", None)
-                or getattr(call.message, "caption_html", None)
-                or call.message.text
-                or call.message.caption
-                or ""
-            )
-            title = content_html.split("\n")[0].replace("<b>", "").replace("</b>", "")
-
-            # ссылки могут быть в entities ИЛИ caption_entities
-            entities = call.message.entities or call.message.caption_entities or []
-            url_ent  = next((e for e in entities if e.type == "text_link"), None)
-
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute(
-                    """
-                    INSERT OR IGNORE INTO user_favorites(tg_user, vacancy_id, title, url)
-                    VALUES(?, ?, ?, ?)
-                    """,
-                    (uid, vac_id, title, url_ent.url if url_ent else "")
-                )
-                await db.commit()
 
-            await bot.answer_callback_query(call.id, "⭐️ Добавлено в избранное")
-            return {"ok": True}
+CALLBACK_HANDLERS = {
+    "back_menu":      on_back_menu,
+    "start_auto":     on_start_auto,
+    "start_manual":   on_start_manual,
+    "open_settings":  on_open_settings,
+    "open_resumes":   on_open_resumes,
+    "open_favorites": on_open_favorites,
+    "fav_prev":       show_prev_fav,
+    "fav_next":       show_next_fav,
+    "show_filters":   on_show_filters,
+    "back_settings":  on_back_settings,
+    "find_jobs":      on_find_jobs,
+    "job_prev":       show_prev_job,
+    "job_next":       on_job_next,
+}
+
+CALLBACK_PREFIXES = [
+    ("fav_del_",        on_fav_del),
+    ("filter_",         on_filter),
+    ("region_suggest_", on_region_suggest),
+    ("select_resume_",  on_select_resume),
+    ("job_apply_",      on_job_apply),
+    ("job_fav_",        on_job_fav),
+    *((f"{m}_suggest_", partial(on_multi_suggest, m)) for m in MULTI_KEYS),
+]
 
 
+# ────────── main webhook ──────────
+@app.post("/bot{token:path}")
+async def telegram_webhook(request: Request, token: str):
+    if token != BOT_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+    update = types.Update(**orjson.loads(await request.body()))
+
+    # ===== CALLBACKS =====
+    if update.callback_query:
+        call = update.callback_query
+        uid = call.from_user.id
+        data = call.data
+
+        await ensure_user(uid)
+
+        handler = CALLBACK_HANDLERS.get(data)
+        if handler:
+            return await handler(call, uid)
+        for prefix, handler in CALLBACK_PREFIXES:
+            if data.startswith(prefix):
+                return await handler(call, uid, data[len(prefix):])
+
     # ===== TEXT =====
     if update.message and update.message.text:
         msg = update.message
@@ -1003,9 +1375,8 @@ async def telegram_webhook(request: Request, token: str):
         text = msg.text.strip()
         pending = await get_pending(uid)
 
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("INSERT OR IGNORE INTO users(chat_id) VALUES (?)", (uid,))
-            await db.commit()
+        if text != "/start":                # /start заводит пользователя в start_txn
+            await ensure_user(uid)
 
         try:
             # ---------- commands ----------
@@ -1013,26 +1384,15 @@ async def telegram_webhook(request: Request, token: str):
                 # ───── /start ───────────────────────────────────────────
                 if text == "/start":
                     await set_pending(uid, None)
+                    async with db() as conn:
+                        token = await start_txn(conn, uid)
 
-                    intro = (
-                        "<b>👋 Добро пожаловать!</b>\n\n"
-                        "Этот бот автоматически откликается на подходящие вакансии hh.ru по вашим фильтрам. "
-                        "Настройте регион, зарплату, график и выберите резюме — остальное я сделаю сам."
-                    )
-
-                    token = await get_user_token(uid)
                     if token is None:
                         # ещё не авторизован — показываем ссылку OAuth
-                        kb = types.InlineKeyboardMarkup(
-                            inline_keyboard=[[types.InlineKeyboardButton(
-                                text="🚀 Начать автоотклики", url=build_oauth_url(uid)
-                            )]]
-                        )
                         await bot.send_message(
                             uid,
-                            intro
-                            + "\n\n<b>Шаг 1.</b> Нажмите кнопку ниже и дайте боту доступ к вашему аккаунту hh.ru.",
-                            reply_markup=kb,
+                            INTRO_OAUTH_HTML,
+                            reply_markup=build_oauth_kb(uid),
                             parse_mode="HTML",
                         )
                         return {"ok": True}
@@ -1040,8 +1400,8 @@ async def telegram_webhook(request: Request, token: str):
                     # уже есть токен — сразу выводим меню
                     menu_msg = await bot.send_message(
                         uid,
-                        f"✅ Вы уже авторизованы.\n\n{intro}",
-                        reply_markup=build_main_menu_keyboard(),
+                        INTRO_AUTHORIZED_HTML,
+                        reply_markup=MAIN_MENU_KB,
                         parse_mode="HTML",
                     )
                     await set_settings_msg_id(uid, menu_msg.message_id)
@@ -1060,46 +1420,35 @@ async def telegram_webhook(request: Request, token: str):
                     await set_pending(uid, None)
                     menu_msg = await bot.send_message(
                         uid,
-                        "📌 Главное меню:",
-                        reply_markup=build_main_menu_keyboard(),
+                        MENU_TEXT,
+                        reply_markup=MAIN_MENU_KB,
                     )
                     await set_settings_msg_id(uid, menu_msg.message_id)
                     return {"ok": True}
 
                 if text == "/settings":
                     await set_pending(uid, None)
-                    msg = await bot.send_message(
-                        uid, "Ваши фильтры:", reply_markup=build_settings_keyboard()
+                    settings_msg = await bot.send_message(
+                        uid, SETTINGS_TEXT, reply_markup=SETTINGS_KB
                     )
-                    await set_settings_msg_id(uid, msg.message_id)
+                    await set_settings_msg_id(uid, settings_msg.message_id)
                     return {"ok": True}
 
-            if pending == "region":
-                await save_user_setting(uid, "region", text)
-                await set_pending(uid, None)
-                msg_id = await get_settings_msg_id(uid)
-                await safe_edit_text_by_id(
-                    uid, msg_id, "Ваши фильтры:", build_settings_keyboard()
-                )
-                return {"ok": True}
-
-            if pending == "salary" and text.isdigit():
-                await save_user_setting(uid, "salary", text)
-                await set_pending(uid, None)
-                msg_id = await get_settings_msg_id(uid)
-                await safe_edit_text_by_id(
-                    uid, msg_id, "Ваши фильтры:", build_settings_keyboard()
-                )
-                return {"ok": True}
-
-            if pending == "keyword":
-                await save_user_setting(uid, "keyword", text)
-                await set_pending(uid, None)
-                msg_id = await get_settings_msg_id(uid)
-                await safe_edit_text_by_id(
-                    uid, msg_id, "Ваши фильтры:", build_settings_keyboard()
-                )
-                return {"ok": True}
+            if pending in PENDING_FIELDS:
+                async with user_lock(uid):
+                    # перечитываем под замком: параллельный апдейт мог уже
+                    # сбросить или сменить поле после чтения выше
+                    field = await get_pending(uid)
+                    check = PENDING_FIELDS.get(field, False)
+                    if check is None or (check and check(text)):
+                        # значение и сброс pending — одна запись в user_settings
+                        await save_user_settings(uid, {field: text, "pending": None})
+                        msg_id = await get_settings_msg_id(uid)
+                        await safe_edit_text_by_id(
+                            uid, msg_id, SETTINGS_TEXT, SETTINGS_KB
+                        )
+                        return {"ok": True}
         finally:
             if pending:
-                await safe_delete(msg)
\ No newline at end of file
+                # удаляем введённый текст в фоне — webhook отвечает сразу
+                spawn(safe_delete(msg))
\ No newline at end of file